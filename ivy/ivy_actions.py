@@ -15,6 +15,8 @@ from . import ivy_ast
 from .ivy_ast import AST, compose_atoms, MixinAfterDef
 from . import ivy_module
 from . import ivy_utils as iu
+import os
+import re
 
 def p_c_a(s):
     a = s.split(':')
@@ -78,6 +80,125 @@ class UnrollContext(ActionContext):
 
 context = ActionContext()
 
+# Memoized updates. The update of an action depends only on the
+# action, the module (its actions, update axioms and background
+# theory), the action context and the checked assertion. Within an
+# isolate, the same updates are computed for many verification
+# conditions, so we cache them. For the checked assertion, only
+# whether it occurs in the action or its callees matters, so the
+# update of an action that does not contain it is shared between the
+# checks of all such assertions. The key includes the actions called,
+# directly or indirectly, which are looked up on each use, so actions
+# may be replaced in the module. The cache holds references to the
+# objects in the key so that their ids are not reused.
+
+opt_update_cache = iu.BooleanParameter("update_cache",True)
+
+update_cache = dict()
+
+def clear_update_cache():
+    update_cache.clear()
+
+def local_lines(action):
+    """ Line numbers of the assertions in action and the names of the
+    actions it calls. The lines are None if action instantiates a
+    macro, since we can't see its assertions. """
+    key = ('lines',id(action))
+    if key not in update_cache:
+        lines = set()
+        for sub in action.iter_subactions():
+            if isinstance(sub,(AssertAction,Ranking)) and hasattr(sub,'lineno'):
+                lines.add(sub.lineno)
+            elif isinstance(sub,InstantiateAction):
+                lines = None
+                break
+        update_cache[key] = (action,(lines,list(action.iter_calls())))
+    return update_cache[key][1]
+
+def checked_lines(action):
+    """ Line numbers of the assertions in action and the actions it
+    calls, or None if unknown, and the actions called. """
+    res,seen,todo,callees = set(),set(),[action],[]
+    while todo:
+        lines,calls = local_lines(todo.pop())
+        if lines is None:
+            res = None
+        elif res is not None:
+            res.update(lines)
+        for name in calls:
+            if name not in seen:
+                seen.add(name)
+                callee = context.get(name)
+                if isinstance(callee,Action):
+                    todo.append(callee)
+                    callees.append(callee)
+    return res,callees
+
+def cached_update(kind,action,domain,pvars,compute):
+    """ Return compute(), the update of kind for action, caching it. """
+    if not opt_update_cache.get() or pvars:
+        return compute()
+    lines,callees = checked_lines(action)
+    ca = checked_assert.get()
+    if lines is not None:
+        ca = None if not lines else ca if not ca or ca in lines else 'other'
+    theory = domain.background_theory(pvars)
+    updates = getattr(domain,'updates',None)
+    refs = [action,domain,theory,updates,context] + callees
+    key = (kind,ca,check_unprovable.get(),determinize,guard_asserts) + tuple(id(x) for x in refs)
+    if key in update_cache:
+        return update_cache[key][1]
+    res = compute()
+    update_cache[key] = (refs,res)
+    return res
+
+# Assertion guards. If guard_asserts is set, the update of an assertion
+# at line L is (g -> fmla, ~g & ~fmla), where the guard g is a global
+# Boolean constant for line L. Setting g false gives the update
+# without a checked assertion, while setting the guard of the checked
+# assertion false and all others true gives the update with
+# checked_assert = L. So a single transition relation can be used to
+# check all of the assertions, under assumptions on the guards.
+#
+# The name of a guard is derived from the location of the assertion
+# (including the locations it was instantiated from), so that it does
+# not change when unrelated assertions are added or removed. This keeps
+# the vc_cache keys of the other checks stable.
+
+guard_asserts = False
+assert_guards = dict()
+
+def guard_name(lineno):
+    lines,file = [],None
+    loc = lineno
+    while isinstance(loc,iu.LocationTuple):
+        lines.append(str(loc.line))
+        file = loc.filename
+        loc = loc.reference
+    base = os.path.splitext(os.path.basename(str(file)))[0] if file else ''
+    return '__ASSERT_' + re.sub('[^A-Za-z0-9_]','_','_'.join([base] + lines))
+
+def assert_guard(lineno):
+    if lineno not in assert_guards:
+        names = set(g.name for g in assert_guards.values())
+        name = guard_name(lineno)
+        while name in names:
+            name += '_'
+        assert_guards[lineno] = bool_const(name)
+    return assert_guards[lineno]
+
+class AssertGuards(object):
+    """ Context Manager for computing updates with assertion guards """
+    def __enter__(self):
+        global guard_asserts
+        self.old_guard_asserts = guard_asserts
+        guard_asserts = True
+        return self
+    def __exit__(self,exc_type, exc_val, exc_tb):
+        global guard_asserts
+        guard_asserts = self.old_guard_asserts
+        return False # don't block any exceptions
+
 class SymExContext(object):
     """ Context Manager for parameterized symbolic execution """
     def __init__(self,params):
@@ -216,7 +337,8 @@ class Action(AST):
         res = (updated,clauses,pre)
         return res
     def update(self,domain,in_scope):
-        return self.hide_formals(bind_olds_action(self.int_update(domain,in_scope)))
+        return cached_update('update',self,domain,in_scope,
+                             lambda: self.hide_formals(bind_olds_action(self.int_update(domain,in_scope))))
     def hide_formals(self,update):
         to_hide = []
         if hasattr(self,'formal_params'):
@@ -349,6 +471,12 @@ class AssertAction(Action):
         type_check(domain,fmla)
         if check_unprovable.get() != unprovable:
             return ([],true_clauses(annot = EmptyAnnotation()),false_clauses(annot = EmptyAnnotation()))
+        if guard_asserts:
+            g = assert_guard(self.lineno)
+            trans = true_clauses() if unprovable else formula_to_clauses(Implies(g,fmla))
+            cl = formula_to_clauses(dual_formula(fmla))
+            cl = Clauses(cl.fmlas+[Not(g)],cl.defs,EmptyAnnotation())
+            return ([],Clauses(trans.fmlas,trans.defs,EmptyAnnotation()),cl)
         ca = checked_assert.get()
         if ca:
             if ca != self.lineno:
@@ -1204,7 +1332,9 @@ class CallAction(Action):
         v = self.get_callee()
         if not isinstance(v,tuple):
             if isinstance(v,Action):
-                v = self.apply_actuals(domain,pvars,v)
+                callee = v
+                v = cached_update('call',self,domain,pvars,
+                                  lambda: self.apply_actuals(domain,pvars,callee))
 #                print "called action: {}".format(v)
             else:
                 v = state_to_action(v.value)
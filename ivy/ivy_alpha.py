@@ -308,20 +308,78 @@ class RelAlg3(RelAlg2):
         self.prim_list.append(z3lit) # so id not lost
         return cubes
 
-def predicate_alpha(state):
-    print ("running predicate alpha")
+# Predicate abstraction. The abstract value of a state is the
+# conjunction of the abstraction predicates that the state implies,
+# given the background theory. The state is added to a solver once.
+# First, the disjunction of the negations of all the predicates is
+# checked. If it is unsat, all the predicates are implied. Then the
+# negation of each predicate not yet decided is checked. Each time a
+# check is sat, all the undecided predicates are evaluated in the
+# model, and the ones that are false are decided at once.
+#
+# The negations are added in a scope (push/pop) rather than guarded
+# by assumption literals. The ground terms of an inactive guarded
+# negation are still used to instantiate the quantifiers of the
+# state, which made the checks much slower. For the same reason, the
+# disjunction is checked only once, since a sat check of it can be
+# slower than the checks of the single predicates.
+#
+# The results are memoized by the clauses of the state in the dict
+# memo, if given. A state that is computed again, for example when
+# the states of an AnalysisGraph are recalculated after a predicate
+# is added, is then checked only for the new predicates. The memo is
+# kept in the AnalysisGraph (see ivy_ui).
+
+def clauses_key(clauses):
+    return (tuple(clauses.fmlas),tuple(tuple(d.args) for d in clauses.defs))
+
+def check_negations(slvr,negs):
+    """ Check the disjunction of negs in a scope of slvr, returning the
+    result and the model, if sat """
+    slvr.push()
+    slvr.add(z3.Or(negs))
+    res = slvr.check()
+    model = slvr.model() if res == z3.sat else None
+    slvr.pop()
+    return res,model
+
+def implied_predicates(clauses,preds):
+    """ Return a list of booleans, telling for each of the
+    predicates preds whether it is implied by clauses """
     slvr = new_solver()
-    clauses = and_clauses(state.clauses,state.domain.background_theory())
     add_clauses(slvr, clauses)
+    negs = [clauses_to_z3(dual_clauses(pred)) for pred in preds]
+    res = [None] * len(preds)
+    def falsify(model):
+        for i,neg in enumerate(negs):
+            if res[i] is None and z3.is_true(model.eval(neg,model_completion=True)):
+                res[i] = False
+    cr,model = check_negations(slvr,negs)
+    if cr == z3.unsat:
+        return [True] * len(preds)
+    if model is not None:
+        falsify(model)
+    for i,neg in enumerate(negs):
+        if res[i] is None:
+            cr,model = check_negations(slvr,[neg])
+            res[i] = cr == z3.unsat
+            if model is not None:
+                falsify(model)
+    return res
+
+def predicate_alpha(state,memo=None):
+    print ("running predicate alpha")
+    clauses = and_clauses(state.clauses,state.domain.background_theory())
+    known = memo.setdefault(clauses_key(clauses),dict()) if memo is not None else dict()
+    preds = state.domain.abstraction_predicates
+    keys = [clauses_key(pred) for pred in preds]
+    todo = dict((key,pred) for key,pred in zip(keys,preds) if key not in known)
+    if todo:
+        known.update(zip(todo,implied_predicates(clauses,list(todo.values()))))
     res = Clauses()
-    for pred in state.domain.abstraction_predicates:
-        slvr.push()
-        add_clauses(slvr,dual_clauses(pred))
-        cr = slvr.check()
-        "predicate: {} result {}".format(pred,cr)
-        if slvr.check() == z3.unsat:
+    for key,pred in zip(keys,preds):
+        if known[key]:
             res = and_clauses(res,pred)
-        slvr.pop()
     state.clauses = res
         
 
@@ -78,6 +78,7 @@ class AnalysisGraph(object):
         self.covering = []
         self.pvars = pvars  # TODO: remove this field
         self.state_graphs = []
+        self.predicate_memo = dict() # results of predicate abstraction (see ivy_alpha)
 
         # delegate some former fields to Module for compat
 
@@ -16,54 +16,287 @@ from . import ivy_ast
 from . import ivy_proof
 from . import ivy_trace
 from . import ivy_interp
+from . import ivy_solver as slv
+import ivy.z3 as z3
+import multiprocessing
+import os
+import sys
+import time
+import traceback
 
-def check_isolate(n_steps,n_unroll=None):
+opt_bmc_incremental = iu.BooleanParameter("bmc_incremental",False)
 
-    if n_unroll is not None:
-        old_actions = im.module.actions
+# Incremental BMC. The unrolling of the transition relation is kept in
+# a single solver, adding one frame per depth. The value of a state
+# symbol x at time k is represented by a frame symbol x@k, and the
+# skolems of each copy of a formula are renamed apart. The invariants
+# at depth k and the failure of the step at depth k are checked under
+# assumption literals, so the solver keeps what it learns. When a check
+# is satisfiable, the usual non-incremental check at the same depth
+# produces (and minimizes) the counterexample.
+
+class Unrolling(object):
+    def __init__(self,init,update,error=None):
+        bgt = im.module.background_theory()
+        defsyms = set(x.defines() for x in bgt.defs)
+        stvars,trans,fail = tr.add_post_axioms(update,bgt)
+        self.mutables = list(stvars)
+        self.stvars = set(stvars) | defsyms
+        self.defsyms = defsyms
+        self.bgt = bgt
+        self.trans = ilu.and_clauses(trans,ilu.Clauses(defs=bgt.defs))
+        self.error = fail if error is None else error
+        self.solver = z3.Solver()
+        self.solver.add(slv.clauses_to_z3(bgt))
+        self.depth = 0
+        self.add(self.bgt,0,'f0')
+        if init is not None:
+            self.add(init,0,'i')
+
+    def rename(self,clauses,k,tag):
+        """ Rename state symbols to frame k, their new versions to frame
+        k+1 and other skolems apart, according to tag. """
+        rn = dict()
+        for sym in ilu.used_symbols_clauses(clauses):
+            if sym in self.stvars:
+                rn[sym] = sym.prefix('__bmc{}_'.format(k))
+            elif tr.is_new(sym) and tr.new_of(sym) in self.stvars:
+                old = tr.new_of(sym)
+                rn[sym] = (old.prefix('__bmc{}_'.format(k+1)) if old not in self.defsyms
+                           else sym.prefix('__bmc{}_'.format(tag)))
+            elif tr.is_skolem(sym):
+                rn[sym] = sym.prefix('__bmc{}_'.format(tag))
+        return ilu.rename_clauses(clauses,rn)
+
+    def add(self,clauses,k,tag,lit=None):
+        fmla = slv.clauses_to_z3(self.rename(clauses,k,tag))
+        self.solver.add(fmla if lit is None else z3.Implies(lit,fmla))
+
+    def check(self,clauses,k,tag,unknown_ok=False):
+        lit = z3.FreshBool('__bmc')
+        self.add(clauses,k,tag,lit)
+        return slv.decide(self.solver,[lit],unknown_ok=unknown_ok)
+
+    def check_state(self,cond,unknown_ok=False):
+        """ Check if cond can hold at the current depth. """
+        return self.check(cond,self.depth,'c{}'.format(self.depth),unknown_ok)
+
+    def check_fail(self,unknown_ok=False):
+        """ Check if the step from the current depth can fail. """
+        return self.check(self.error,self.depth,'e{}'.format(self.depth),unknown_ok)
+
+    def step(self):
+        """ Unroll one more step. """
+        k = self.depth
+        self.add(self.trans,k,'t{}'.format(k))
+        self.depth = k + 1
+        self.add(self.bgt,k+1,'f{}'.format(k+1))
 
+    def distinct(self,i,j):
+        """ Formula stating that the states at frames i and j differ. """
+        disjs = []
+        for sym in self.mutables:
+            syms = [sym.prefix('__bmc{}_'.format(k)) for k in (i,j)]
+            dom = sym.sort.dom if hasattr(sym.sort,'dom') else []
+            if dom:
+                vs = [il.Variable('X{}'.format(n),s) for n,s in enumerate(dom)]
+                disjs.append(il.Exists(vs,il.Not(il.Equals(*[x(*vs) for x in syms]))))
+            else:
+                disjs.append(il.Not(il.Equals(*syms)))
+        return slv.formula_to_z3(il.Or(*disjs))
+
+def unroll_actions(n_unroll):
+    """ Unroll the loops in the actions n_unroll times. Returns the
+    original actions. """
+    old_actions = im.module.actions
+    if n_unroll is not None:
         im.module.actions = dict()
         for actname,action in old_actions.items():
             im.module.actions[actname] = action.unroll_loops(lambda x: n_unroll)
-    
-    step_action = ia.env_action(None)
-
-    conjectures = im.module.conjs
-    conj = ilu.and_clauses(*conjectures)
-
-    used_names = frozenset(x.name for x in list(il.sig.symbols.values()))
-    def witness(v):
-        c = lg.Const('@' + v.name, v.sort)
-        assert c.name not in used_names
-        return c
-    clauses = ilu.dual_clauses(conj, witness)
-
-    ag = art.AnalysisGraph()
-    with ag.context as ac:
-#                post = ac.new_state(ag.init_cond)
-        ag.add_initial_state(ag.init_cond)
-        post = ag.states[0]
-    if 'initialize' in im.module.actions:
-        init_action = im.module.actions['initialize']
-        post = ag.execute(init_action, None, None, 'initialize')
+    return old_actions
+
+class Bounded(object):
+    """ The states reached by the exported actions from the initial
+    state, for producing counterexamples. In incremental mode, the
+    states of the analysis graph are only computed when a
+    counterexample is found. """
+
+    def __init__(self,incremental):
+        self.step_action = ia.env_action(None)
+        conjectures = im.module.conjs
+        self.conj = ilu.and_clauses(*conjectures) if conjectures else ilu.true_clauses()
+
+        used_names = frozenset(x.name for x in list(il.sig.symbols.values()))
+        def witness(v):
+            c = lg.Const('@' + v.name, v.sort)
+            assert c.name not in used_names
+            return c
+        self.clauses = ilu.dual_clauses(self.conj, witness)
+
+        ag = self.ag = art.AnalysisGraph()
+        with ag.context as ac:
+            ag.add_initial_state(ag.init_cond)
+            post = ag.states[0]
+        if 'initialize' in im.module.actions:
+            init_action = im.module.actions['initialize']
+            post = ag.execute(init_action, None, None, 'initialize')
+        self.states = [post]
+
+        self.update = None
+        self.unrolling = None
+        if incremental:
+            self.update = self.step_action.update(im.module,{})
+            self.unrolling = Unrolling(ag.get_history(post).post,self.update)
+
+    def state_at(self,n):
+        while len(self.states) <= n:
+            with ivy_interp.EvalContext(False):
+                self.states.append(self.ag.execute(self.step_action,self.states[-1]))
+        return self.states[n]
+
+    def check(self,n):
+        """ Check the invariants at depth n and the failure of the step
+        from depth n. Returns the bound and the counterexample, if
+        any. """
+        ag,unrolling = self.ag,self.unrolling
+        if unrolling is None or unrolling.check_state(self.clauses) == z3.sat:
+            res = ivy_trace.check_final_cond(ag,self.state_at(n),self.clauses,[],True)
+            if res is not None:
+                return n,res
+        if unrolling is None or unrolling.check_fail() == z3.sat:
+            post = self.state_at(n+1)
+            fail = ivy_interp.State(expr = ivy_interp.fail_expr(post.expr))
+            res = ivy_trace.check_final_cond(ag,fail,ilu.true_clauses(),[],True)
+            if res is not None:
+                return n+1,res
+        if unrolling is not None:
+            unrolling.step()
+        return None
+
+def check_isolate(n_steps,n_unroll=None):
+
+    old_actions = unroll_actions(n_unroll)
+    incremental = opt_bmc_incremental.get()
+    bmc = Bounded(incremental)
+
+    # The incremental engine also reports the time taken at each depth.
 
     for n in range(n_steps + 1):
-        print('Checking invariants at depth {}...'.format(n))
-        res = ivy_trace.check_final_cond(ag,post,clauses,[],True)
-        if res is not None:
-            print('BMC with bound {} found a counter-example...'.format(n))
+        if incremental:
+            print('Checking invariants at depth {}...'.format(n), end=' ')
+            sys.stdout.flush()
+        else:
+            print('Checking invariants at depth {}...'.format(n))
+        start = time.time()
+        cex = bmc.check(n)
+        if cex is not None:
+            print('BMC with bound {} found a counter-example...'.format(cex[0]))
             print()
-            print(res)
-            exit(0)
-        with ivy_interp.EvalContext(False):
-            post = ag.execute(step_action)
-        fail = ivy_interp.State(expr = ivy_interp.fail_expr(post.expr))
-        res = ivy_trace.check_final_cond(ag,fail,ilu.true_clauses(),[],True)
-        if res is not None:
-            print('BMC with bound {} found a counter-example...'.format(n+1))
-            print()
-            print(res)
+            print(cex[1])
             exit(0)
+        if incremental:
+            print('{:.2f}s'.format(time.time() - start))
 
-    if n_unroll is not None:
+    im.module.actions = old_actions
+
+# k-induction. The property P is the conjunction of the invariants and
+# the absence of assertion failures. The base case at depth k is the
+# BMC check of the states reached in k-1 steps from the initial state.
+# The inductive step at depth k checks that on any path of k distinct
+# states satisfying P, the next state satisfies P. On the path, the
+# assertions of the actions are assumed, so it only contains steps that
+# do not fail. If both cases hold at some depth, P is proved.
+#
+# The two cases are independent, so the inductive steps are checked in
+# a forked process while the parent checks the base cases. A
+# counterexample to the base case is built by the BMC check.
+
+def assertions_assumed():
+    """ The transition relation of the exported actions, with their
+    assertions assumed. """
+    kinds = [ia.AssertAction,ia.EnsuresAction,ia.RequiresAction]
+    old_actions = im.module.actions
+    im.module.actions = dict((actname,action.assert_to_assume(kinds))
+                             for actname,action in old_actions.items())
+    try:
+        return ia.env_action(None).update(im.module,{})
+    finally:
+        im.module.actions = old_actions
+
+def induction_steps(n_steps,conj,clauses,error):
+    """ Generate, for depth k = 1...n_steps, whether the inductive step
+    holds at depth k, and the reason if the solver gave up. """
+    unrolling = Unrolling(None,assertions_assumed(),error)
+    for k in range(1,n_steps + 1):
+        unrolling.add(conj,k-1,'a{}'.format(k-1))
+        unrolling.step()
+        for i in range(k):
+            unrolling.solver.add(unrolling.distinct(i,k))
+        res = unrolling.check_state(clauses,unknown_ok=True)
+        if res == z3.unsat:
+            res = unrolling.check_fail(unknown_ok=True)
+        reason = slv.reason_unknown(unrolling.solver) if res == z3.unknown else None
+        yield k,res == z3.unsat,reason
+        if res == z3.unsat:
+            return
+
+def induction_worker(conn,*args):
+    try:
+        for res in induction_steps(*args):
+            conn.send(res)
+    except Exception:
+        conn.send((None,False,traceback.format_exc()))
+    conn.close()
+
+def check_isolate_kind(n_steps,n_unroll=None):
+
+    old_actions = unroll_actions(n_unroll)
+    bmc = Bounded(True)
+    args = (n_steps,bmc.conj,bmc.clauses,bmc.update[2])
+
+    # A daemonic process, such as a worker of jobs=N, cannot have
+    # children, so in that case the steps are checked in-process.
+
+    proc = None
+    if hasattr(os,'fork') and not multiprocessing.current_process().daemon:
+        sys.stdout.flush()
+        ctx = multiprocessing.get_context('fork')
+        conn,child_conn = ctx.Pipe(False)
+        proc = ctx.Process(target=induction_worker,args=(child_conn,)+args)
+        proc.start()
+        child_conn.close()
+        def step_result():
+            try:
+                return conn.recv()
+            except EOFError:
+                raise iu.IvyError(None,'k-induction worker process exited unexpectedly')
+    else:
+        steps = induction_steps(*args)
+        def step_result():
+            return next(steps)
+
+    try:
+        for k in range(1,n_steps + 1):
+            print('Checking {}-induction...'.format(k), end=' ')
+            sys.stdout.flush()
+            start = time.time()
+            cex = bmc.check(k-1)
+            if cex is not None:
+                print('CEX ({:.2f}s)'.format(time.time() - start))
+                print('k-induction found a counter-example of length {}...'.format(cex[0]))
+                print()
+                return cex[1]
+            depth,proved,reason = step_result()
+            if depth is None:
+                sys.stderr.write(reason)
+                exit(1)
+            status = 'PROVED' if proved else 'UNKNOWN' if reason is None else 'UNKNOWN ({})'.format(reason)
+            print('{} ({:.2f}s)'.format(status,time.time() - start))
+            if proved:
+                return None
+    finally:
         im.module.actions = old_actions
+        if proc is not None:
+            proc.terminate()
+            proc.join()
+    raise iu.IvyError(None,'k-induction inconclusive up to depth {}'.format(n_steps))
@@ -8,7 +8,6 @@ from . import ivy_utils as utl
 from . import ivy_logic_utils as lut
 from . import ivy_logic as lg
 from . import ivy_utils as iu
-from . import ivy_ui
 from . import ivy_module as im
 from . import ivy_alpha
 from . import ivy_art
@@ -24,13 +23,16 @@ from . import ivy_proof
 from . import ivy_trace
 from . import ivy_temporal as itmp
 from . import ivy_printer
-from . import ivy_l2s
-from . import ivy_mc
-from . import ivy_vmt
-from . import ivy_bmc
 from . import ivy_tactics
 
 import sys
+import io
+import contextlib
+import traceback
+import multiprocessing
+import json
+import csv
+import time
 from collections import defaultdict
 
 diagnose = iu.BooleanParameter("diagnose",False)
@@ -40,6 +42,19 @@ opt_trusted = iu.BooleanParameter("trusted",False)
 opt_mc = iu.BooleanParameter("mc",False)
 opt_trace = iu.BooleanParameter("trace",False)
 opt_separate = iu.BooleanParameter("separate",None)
+opt_jobs = iu.Parameter("jobs",1,check=lambda s: s.isdigit() and int(s) > 0,process=int)
+opt_profile = iu.Parameter("profile","")
+
+# The user interface and the model checking methods are needed only
+# for some options and isolates, so their modules are imported when
+# used, to make start-up faster. Setting one of their parameters
+# imports the module (see set_parameters), as does using one of the
+# l2s tactics.
+
+iu.lazy_parameters.update({'mode':'ivy_ui','l2s_debug':'ivy_l2s','fullqi':'ivy_mc',
+                           'mc_engine':'ivy_mc','mc_sim':'ivy_mc','bmc_incremental':'ivy_bmc'})
+for name in ['l2s','l2s_full','l2s_auto','l2s_auto2','l2s_auto3','l2s_auto4','l2s_auto5']:
+    ivy_proof.lazy_tactics[name] = 'ivy_l2s'
 
 def display_cex(msg,ag):
     if diagnose.get():
@@ -75,6 +90,7 @@ def show_counterexample(ag,state,bmc_res):
 
 def gui_art(other_art):
     from . import tk_ui as ui
+    from . import ivy_ui
 #    iu.set_parameters({'mode':'induction'})
 #    iu.set_parameters({'ui':'cti'})
     gui = ui.new_ui()
@@ -176,6 +192,7 @@ def get_checked_actions():
     return []
 
 failures = 0
+unknowns = 0
 
 def print_dots():
     print('...', end=' ')
@@ -213,6 +230,10 @@ class Checker(object):
         return not (diagnose.get() or opt_trace.get()) # ignore failures if not diagnosing
     def unsat(self):
         return self.fail() if act.check_unprovable.get() else self._pass()
+    def unknown(self,reason):
+        print('UNKNOWN ({})'.format(reason))
+        global unknowns
+        unknowns += 1
     def assume(self):
         return False
     def get_annot(self):
@@ -228,6 +249,80 @@ class Checker(object):
             print('PASS')
         return True
 
+# Profiling. With the option profile=<file>, a record is kept for each
+# verification condition, giving its isolate, action and line, the
+# time to compute the action's transition relation ("execute"), and
+# the measurements taken by the solver (see ivy_solver.vc_profiler).
+# The records are written to the file as JSON, or CSV if the file name
+# ends in ".csv", with the slowest conditions first in the summary.
+
+profile_records = []
+profile_context = dict()
+
+# The line reported is the innermost reference, as in the location
+# printed for the check.
+
+def profile_line(lineno):
+    if not isinstance(lineno,iu.LocationTuple):
+        return None
+    while isinstance(lineno.reference,iu.LocationTuple):
+        lineno = lineno.reference
+    return lineno.line
+
+def profile_vc(fc,data):
+    data.update(profile_context)
+    if isinstance(fc,ConjChecker):
+        lineno = getattr(fc.lf,'lineno',None)
+        data['line'] = profile_line(lineno)
+        data['property'] = str(pretty_label(fc.lf.label))
+    profile_records.append(data)
+
+@contextlib.contextmanager
+def profile_action(action,lineno=None):
+    profile_context['action'] = action
+    profile_context['line'] = profile_line(lineno)
+    start = time.time()
+    try:
+        yield
+    finally:
+        profile_context['execute'] = time.time() - start
+
+def vc_time(rec):
+    return rec.get('build',0) + rec.get('solve',0) + rec.get('minimize',0)
+
+def profile_summary(recs):
+    def totals(key):
+        res = defaultdict(float)
+        execs = dict()
+        for rec in recs:
+            k = key(rec)
+            res[k] += vc_time(rec)
+            execs[k,rec.get('action')] = rec.get('execute',0)
+        for (k,a),t in execs.items():
+            res[k] += t
+        return sorted(([k,t] for k,t in res.items()),key=lambda x: -x[1])
+    return {'vcs' : len(recs),
+            'time' : sum(vc_time(rec) for rec in recs),
+            'isolates' : totals(lambda rec: rec.get('isolate')),
+            'actions' : totals(lambda rec: '{}:{}'.format(rec.get('isolate'),rec.get('action'))),
+            'slowest' : sorted(recs,key=lambda rec: -vc_time(rec))[:20],
+            'z3_cache' : islv.translation_stats()}
+
+def write_profile(fname):
+    stats_keys = ['conflicts','quant instantiations']
+    with open(fname,'w') as f:
+        if fname.endswith('.csv'):
+            keys = ['isolate','action','line','property','result','execute','setup',
+                    'build','solve','minimize','time']
+            wr = csv.writer(f)
+            wr.writerow(keys + stats_keys)
+            for rec in sorted(profile_records,key=lambda rec: -vc_time(rec)):
+                row = dict(rec,time=vc_time(rec))
+                wr.writerow([row.get(k,'') for k in keys] +
+                            [rec['stats'].get(k,'') for k in stats_keys])
+        else:
+            json.dump({'vcs':profile_records,'summary':profile_summary(profile_records)},f,indent=1)
+
 def pretty_label(label):
     return "(no name)" if label is None else label
 
@@ -394,7 +489,7 @@ def check_fcs_in_state(mod,ag,post,fcs):
             show_counterexample(ag,post,res)
     return not any(fc.failed for fc in fcs)
 
-def check_conjs_in_state(mod,ag,post,indent=8):
+def conj_checkers(mod,indent=8):
     conjs = mod.conj_subgoals if mod.conj_subgoals is not None else mod.labeled_conjs
     conjs = [x for x in conjs if is_check_mod_unprovable(x)]
     check_lineno = act.checked_assert.get()
@@ -404,13 +499,80 @@ def check_conjs_in_state(mod,ag,post,indent=8):
         lcs = [sub for sub in conjs if sub.lineno == check_lineno]
     else:
         lcs = conjs
-    return check_fcs_in_state(mod,ag,post,[ConjChecker(c,indent) for c in lcs])
+    return [ConjChecker(c,indent) for c in lcs]
+
+def check_conjs_in_state(mod,ag,post,indent=8):
+    return check_fcs_in_state(mod,ag,post,conj_checkers(mod,indent))
 
 def check_safety_in_state(mod,ag,post,report_pass=True):
     return check_fcs_in_state(mod,ag,post,[Checker(lg.Or(),report_pass=report_pass)])
 
 opt_summary = iu.BooleanParameter("summary",False)
 
+# Solver sessions. With vc_session=true, the checks of an exported
+# action in an isolate share one solver session (see
+# ivy_solver.Session). The transition relation of the action is
+# computed once, with assertion guards (see ivy_actions.AssertGuards),
+# and its post-state and failure histories are each added to the
+# session once. The invariant is checked assuming all guards false,
+# and each guarantee assuming its guard false and the others true.
+# Sessions are only used when no counterexample is needed, so not with
+# diagnose or trace. They are created for each isolate, so they see the
+# module of the isolate.
+
+opt_vc_session = iu.BooleanParameter("vc_session",True)
+
+def use_sessions():
+    return (opt_vc_session.get() and not diagnose.get() and not opt_trace.get()
+            and check_lineno is None)
+
+class ActionSession(object):
+    def __init__(self,mod,actname):
+        self.ag = ivy_art.AnalysisGraph()
+        pre = itp.State()
+        pre.clauses = get_conjs(mod)
+        with act.AssertGuards(), itp.EvalContext(check=False):
+            self.post = self.ag.execute(act.env_action(actname),prestate=pre)
+        self.session = islv.Session(im.module.background_theory())
+
+    def history(self,key):
+        """ The post-state or failure history, and the guards it uses. """
+        with act.AssertGuards(), itp.EvalContext(check=False):
+            if key == 'post':
+                clauses = self.ag.get_history(self.post).post
+            else:
+                fail = itp.State(expr = itp.fail_expr(self.post.expr))
+                clauses = self.ag.get_history(fail).post
+        syms = lut.used_symbols_clauses(clauses)
+        guards = [g for g in act.assert_guards.values() if g.rep in syms]
+        return clauses,guards
+
+    def check(self,key,fcs,checked=None):
+        if key not in self.session.lits:
+            clauses,guards = self.history(key)
+            self.session.activate(key,clauses)
+            setattr(self,key+'_guards',guards)
+        guards = getattr(self,key+'_guards')
+        atoms = [self.session.lits[key]]
+        for g in guards:
+            on = checked is not None and act.assert_guards.get(checked) is not g
+            atoms.append(islv.formula_to_z3(g if on else lg.Not(g)))
+        self.session.check(filter_fcs(fcs),atoms)
+        return not any(fc.failed for fc in fcs)
+
+    def check_conjs(self,indent=8):
+        return self.check('post',conj_checkers(im.module,indent))
+
+    def check_guarantee(self,lineno):
+        return self.check('fail',[Checker(lg.Or(),report_pass=False)],lineno)
+
+action_sessions = dict()
+
+def get_action_session(mod,actname):
+    if actname not in action_sessions:
+        action_sessions[actname] = ActionSession(mod,actname)
+    return action_sessions[actname]
+
 # This gets the pre-state for inductive checks. Only implicit conjectures are used.
 
 def get_conjs(mod):
@@ -459,6 +621,8 @@ def check_isolate(trace_hook = None):
     #    print 'check_lineno: {}'.format(check_lineno)
         check = not opt_summary.get()
         unprovable = act.check_unprovable.get()
+        action_sessions.clear()
+        act.assert_guards.clear()
         subgoalmap = dict((x.id,y) for x,y in im.module.subgoals)
         axioms = [m for m in mod.labeled_axioms if m.id not in subgoalmap] 
         schema_instances = [m for m in mod.labeled_axioms if m.id in subgoalmap]
@@ -483,6 +647,7 @@ def check_isolate(trace_hook = None):
                 props = [x for x in im.module.labeled_props if not x.temporal]
                 props = [p for p in props if not(p.id in subgoalmap and p.explicit)]
                 fcs = ([(ConjAssumer if prop.assumed or prop.id in subgoalmap else ConjChecker)(prop) for prop in props])
+                profile_context.update(action=None,line=None,execute=0.0)
                 check_fcs_in_state(mod,ag,pre,fcs)
             else:
                 for lf in schema_instances + mod.labeled_props:
@@ -529,7 +694,8 @@ def check_isolate(trace_hook = None):
             print("\n    Initialization must establish the invariant")
             if check:
                 with itp.EvalContext(check=False):
-                    ag = ivy_art.AnalysisGraph(initializer=lambda x:None)
+                    with profile_action('init'):
+                        ag = ivy_art.AnalysisGraph(initializer=lambda x:None)
                     check_conjs_in_state(mod,ag,ag.states[0])
             else:
                 print('')
@@ -544,7 +710,8 @@ def check_isolate(trace_hook = None):
             if guarantees and not unprovable:
                 print("\n    Any assertions in initializers must be checked", end=' ')
                 if check:
-                    ag = ivy_art.AnalysisGraph(initializer=lambda x:None)
+                    with profile_action('init'):
+                        ag = ivy_art.AnalysisGraph(initializer=lambda x:None)
                     fail = itp.State(expr = itp.fail_expr(ag.states[0].expr))
                     check_safety_in_state(mod,ag,fail)
 
@@ -556,11 +723,15 @@ def check_isolate(trace_hook = None):
             for actname in sorted(checked_actions):
                 action = act.env_action(actname)
                 print("        {}{}".format(pretty_lineno(action),actname))
-                if check:
+                if check and use_sessions():
+                    with profile_action(actname):
+                        session = get_action_session(mod,actname)
+                    session.check_conjs(indent=12)
+                elif check:
                     ag = ivy_art.AnalysisGraph()
                     pre = itp.State()
                     pre.clauses = get_conjs(mod)
-                    with itp.EvalContext(check=False): # don't check safety
+                    with itp.EvalContext(check=False), profile_action(actname): # don't check safety
     #                    post = ag.execute(action, pre, None, actname)
                         post = ag.execute(action, pre)
                     check_conjs_in_state(mod,ag,post,indent=12)
@@ -618,20 +789,28 @@ def check_isolate(trace_hook = None):
                         old_checked_assert = act.checked_assert.get()
                         act.checked_assert.value = sub.lineno
                         some_failed = False
+                        old_unknowns = unknowns
                         for root in checked_actions:
-                            if root in roots:
+                            if root in roots and use_sessions():
+                               tried.add((root,sub.lineno))
+                               with profile_action(root,sub.lineno):
+                                   session = get_action_session(mod,root)
+                               if not session.check_guarantee(sub.lineno):
+                                   some_failed = True
+                                   break
+                            elif root in roots:
                                tried.add((root,sub.lineno))
                                action = act.env_action(root)
                                ag = ivy_art.AnalysisGraph()
                                pre = itp.State()
                                pre.clauses = get_conjs(mod)
-                               with itp.EvalContext(check=False):
+                               with itp.EvalContext(check=False), profile_action(root,sub.lineno):
                                    post = ag.execute(action,prestate=pre)
                                fail = itp.State(expr = itp.fail_expr(post.expr))
                                if not check_safety_in_state(mod,ag,fail,report_pass=False):
                                    some_failed = True
                                    break
-                        if not some_failed:
+                        if not some_failed and unknowns == old_unknowns:
                             print('PASS')
                         act.checked_assert.value = old_checked_assert
                     else:
@@ -656,7 +835,7 @@ def check_subgoals(goals,method=None):
             model = conc.model
             fmla = conc.fmla
             if not lg.is_true(fmla):
-                raise IvyError(goal,
+                raise iu.IvyError(goal,
                   """The temporal subgoal {} has not been reduced to an invariance property. 
                      Try using a tactic such as l2s.""")
             mod = im.module.copy()
@@ -726,6 +905,7 @@ def check_subgoals(goals,method=None):
                         check_isolate()
                 
 def mc_tactic(prover,goals,proof):
+    from . import ivy_l2s, ivy_mc
     goal = goals[0]
     conc = ivy_proof.goal_conc(goal)
     if isinstance(conc,ivy_ast.TemporalModels):
@@ -740,6 +920,7 @@ def mc_tactic(prover,goals,proof):
 ivy_proof.register_tactic('mc',mc_tactic)
 
 def vmt_tactic(prover,goals,proof):
+    from . import ivy_l2s, ivy_vmt
     goal = goals[0]
     conc = ivy_proof.goal_conc(goal)
     if isinstance(conc,ivy_ast.TemporalModels):
@@ -791,7 +972,7 @@ def check_separately(isolate):
         return opt_separate.get()
     return get_isolate_attr(isolate,'separate','false') == 'true'
 
-def mc_isolate(isolate,meth=ivy_mc.check_isolate):
+def mc_isolate(isolate,meth):
     im.module.labeled_axioms.extend(lf for lf in im.module.labeled_props if lf.assumed)
     im.module.labeled_props = [lf for lf in im.module.labeled_props if not lf.assumed]
     if any(not x.temporal for x in im.module.labeled_props):
@@ -816,12 +997,145 @@ def mc_isolate(isolate,meth=ivy_mc.check_isolate):
                 exit(1)
             act.checked_assert.value = old_checked_assert
     
+def get_mc_engines(isolate):
+    from . import ivy_mc
+    if ivy_mc.opt_mc_engine.get():
+        return ivy_mc.opt_mc_engine.get()
+    return get_isolate_attr(isolate,'mc_engine','')
+
+# The solver limits vc_timeout, vc_memory and vc_retries can be set
+# for an isolate by attributes of the same name, overriding the
+# options, e.g., "attribute iso.vc_timeout = 60".
+
+@contextlib.contextmanager
+def isolate_vc_limits(isolate):
+    saved = []
+    for param in [islv.opt_vc_timeout,islv.opt_vc_memory,islv.opt_vc_retries]:
+        val = get_isolate_attr(isolate,param.key,None)
+        if val is not None:
+            saved.append((param,param.get()))
+            param.set(val)
+    try:
+        yield
+    finally:
+        for param,val in saved:
+            param.value = val
+
 def get_isolate_method(isolate):
     if opt_mc.get():
         return 'mc'
     return get_isolate_attr(isolate,'method','ic')
 
 
+def check_one_isolate(isolate):
+    if isolate is not None and isolate in im.module.isolates:
+        idef = im.module.isolates[isolate]
+        if len(idef.verified()) == 0 or isinstance(idef,ivy_ast.TrustedIsolateDef):
+            return # skip if nothing to verify
+    if isolate:
+        print("\nIsolate {}:".format(isolate))
+    profile_context['isolate'] = isolate
+    if isolate is not None and iu.compose_names(isolate,'macro_finder') in im.module.attributes:
+        save_macro_finder = islv.opt_macro_finder.get()
+        if save_macro_finder:
+            print("Turning off macro_finder")
+            islv.set_macro_finder(False)
+    with im.module.copy(), isolate_vc_limits(isolate):
+        ivy_isolate.create_isolate(isolate) # ,ext='ext'
+        act.clear_update_cache()
+        if opt_trusted.get():
+            return
+        method_name = get_isolate_method(isolate)
+        if method_name == 'mc':
+            from . import ivy_mc
+            engines = get_mc_engines(isolate)
+            mc_isolate(isolate,lambda : ivy_mc.check_isolate(engines=engines))
+        elif method_name == 'vmt':
+            from . import ivy_vmt
+            mc_isolate(isolate,meth=ivy_vmt.check_isolate)
+        elif method_name.startswith('bmc['):
+            global some_bounded
+            some_bounded = True
+            from . import ivy_bmc
+            _,prms = iu.parse_int_subscripts(method_name)
+            if len(prms) < 1 or len(prms) > 2:
+                raise iu.IvyError(None,'BMC method specifier should be bmc[<steps>] or bmc[<steps>][<unroll>]. Got "{}".'.format(method_name))
+            mc_isolate(isolate,lambda : ivy_bmc.check_isolate(prms[0],n_unroll = prms[1] if len(prms) >= 2 else None))
+        elif method_name.startswith('kind['):
+            from . import ivy_bmc
+            _,prms = iu.parse_int_subscripts(method_name)
+            if len(prms) < 1 or len(prms) > 2:
+                raise iu.IvyError(None,'k-induction method specifier should be kind[<depth>] or kind[<depth>][<unroll>]. Got "{}".'.format(method_name))
+            mc_isolate(isolate,lambda : ivy_bmc.check_isolate_kind(prms[0],n_unroll = prms[1] if len(prms) >= 2 else None))
+        else:
+            logic = get_isolate_attr(isolate,'complete',None)
+            if logic is not None:
+                im.module.logics = [logic]
+            check_isolate()
+    if isolate is not None and iu.compose_names(isolate,'macro_finder') in im.module.attributes:
+        if save_macro_finder:
+            print("Turning on macro_finder")
+            islv.set_macro_finder(True)
+
+# Isolates are checked independently, each in its own copy of the
+# module, so they can be farmed out to worker processes. The workers
+# are forked after the module is read, so they inherit the module
+# state. Each isolate gets a fresh worker, so that it starts from the
+# same state regardless of scheduling. The output of each isolate is
+# captured and printed by the parent in the original isolate order.
+# The outcome is returned as a status tuple so that errors and exits
+# in a worker have the same effect as in a serial run.
+
+def check_isolate_worker(isolate):
+    global failures, unknowns, some_bounded, checked_action_found
+    failures = 0
+    unknowns = 0
+    del profile_records[:]
+    some_bounded = False
+    checked_action_found = False
+    ivy_tactics.used_sorry = False
+    out = io.StringIO()
+    status = None
+    with contextlib.redirect_stdout(out):
+        try:
+            check_one_isolate(isolate)
+        except iu.IvyError as e:
+            status = ('error',str(e))
+        except SystemExit as e:
+            status = ('exit',e.code)
+        except Exception:
+            status = ('raise',traceback.format_exc())
+    return (out.getvalue(),failures,unknowns,some_bounded,checked_action_found,
+            ivy_tactics.used_sorry,profile_records,islv.translation_stats(),status)
+
+def check_isolates_parallel(isolates):
+    global failures, unknowns, some_bounded, checked_action_found
+    sys.stdout.flush()
+    ctx = multiprocessing.get_context('fork')
+    with ctx.Pool(min(opt_jobs.get(),len(isolates)),maxtasksperchild=1) as pool:
+        for res in pool.imap(check_isolate_worker,isolates):
+            out,fails,unks,bounded,found,sorry,recs,counts,status = res
+            profile_records.extend(recs)
+            for k in islv.translation_counts:
+                islv.translation_counts[k] += counts[k]
+            sys.stdout.write(out)
+            sys.stdout.flush()
+            failures += fails
+            unknowns += unks
+            some_bounded = some_bounded or bounded
+            checked_action_found = checked_action_found or found
+            ivy_tactics.used_sorry = ivy_tactics.used_sorry or sorry
+            if status is not None:
+                pool.terminate()
+                kind,val = status
+                if kind == 'error':
+                    print(val)
+                    exit(1)
+                if kind == 'raise':
+                    sys.stderr.write(val)
+                    exit(1)
+                exit(val)
+
 def check_module():
     # If user specifies an isolate, check it. Else, if any isolates
     # are specificied in the file, check all, else check globally.
@@ -841,46 +1155,20 @@ def check_module():
     if missing:
         raise iu.IvyError(None,"Some assertions are not checked")
 
-    for isolate in isolates:
-        if isolate is not None and isolate in im.module.isolates:
-            idef = im.module.isolates[isolate]
-            if len(idef.verified()) == 0 or isinstance(idef,ivy_ast.TrustedIsolateDef):
-                continue # skip if nothing to verify
-        if isolate:
-            print("\nIsolate {}:".format(isolate))
-        if isolate is not None and iu.compose_names(isolate,'macro_finder') in im.module.attributes:
-            save_macro_finder = islv.opt_macro_finder.get()
-            if save_macro_finder:
-                print("Turning off macro_finder")
-                islv.set_macro_finder(False)
-        with im.module.copy():
-            ivy_isolate.create_isolate(isolate) # ,ext='ext'
-            if opt_trusted.get():
-                continue
-            method_name = get_isolate_method(isolate)
-            if method_name == 'mc':
-                mc_isolate(isolate)
-            elif method_name == 'vmt':
-                mc_isolate(isolate,meth=ivy_vmt.check_isolate)
-            elif method_name.startswith('bmc['):
-                global some_bounded
-                some_bounded = True
-                _,prms = iu.parse_int_subscripts(method_name)
-                if len(prms) < 1 or len(prms) > 2:
-                    raise IvyError(None,'BMC method specifier should be bmc[<steps>] or bmc[<steps>][<unroll>]. Got "{}".'.format(method_name))
-                mc_isolate(isolate,lambda : ivy_bmc.check_isolate(prms[0],n_unroll = prms[1] if len(prms) >= 2 else None))
-            else:
-                logic = get_isolate_attr(isolate,'complete',None)
-                if logic is not None:
-                    im.module.logics = [logic]
-                check_isolate()
-        if isolate is not None and iu.compose_names(isolate,'macro_finder') in im.module.attributes:
-            if save_macro_finder:
-                print("Turning on macro_finder")
-                islv.set_macro_finder(True)
+    if opt_profile.get():
+        islv.vc_profiler = profile_vc
+    if opt_jobs.get() > 1 and len(isolates) > 1 and not diagnose.get():
+        check_isolates_parallel(isolates)
+    else:
+        for isolate in isolates:
+            check_one_isolate(isolate)
     print('')
+    if opt_profile.get():
+        write_profile(opt_profile.get())
     if failures > 0:
         raise iu.IvyError(None,"failed checks: {}".format(failures))
+    if unknowns > 0:
+        raise iu.IvyError(None,"inconclusive checks: {}".format(unknowns))
     if checked_action.get() and not checked_action_found:
         raise iu.IvyError(None,"{} is not an exported action of any isolate".format(checked_action.get()))
 
@@ -26,6 +26,10 @@ from . import ivy_proof as ip
 from collections import defaultdict
 from tarjan import tarjan
 import importlib
+import hashlib
+import io
+import os
+import sys
 
 opt_mutax = iu.BooleanParameter("mutax",False)
 
@@ -1019,7 +1023,7 @@ def resolve_alias(name):
     res = resolve_alias_int(name)
     return res
 
-defined_attributes = set(["weight","test","check","mc","bmc","method","separate","iterable","cardinality","radix","override","cppstd","libspec","macro_finder","global_parameter","complete"])
+defined_attributes = set(["weight","test","check","mc","bmc","method","separate","iterable","cardinality","radix","override","cppstd","libspec","macro_finder","global_parameter","complete","mc_engine","vc_timeout","vc_memory","vc_retries"])
 
 class IvyDomainSetup(IvyDeclInterp):
     def __init__(self,domain):
@@ -2264,8 +2268,30 @@ def clear_rules(modname):
         if s.startswith('p_'):
             del d[s]
 
-def read_module(f,nested=False):
+# The parser modules define the grammar rules of the current language
+# version when they are executed. For each version, the modules are
+# executed once and their contents saved, so that switching back to a
+# version restores its parser instead of building it again.
+
+parser_versions = dict()  # version -> saved contents of parser modules
+
+def set_parser_version(version,old_version):
     from . import ivy_logic_parser
+    from . import ivy_parser
+    mods = [ivy_logic_parser,ivy_parser]
+    parser_versions.setdefault(old_version,[dict(mod.__dict__) for mod in mods])
+    clear_rules('ivy_logic_parser')
+    clear_rules('ivy_parser')
+    if version in parser_versions:
+        for mod,saved in zip(mods,parser_versions[version]):
+            mod.__dict__.update(saved)
+    else:
+        for mod in mods:
+            importlib.reload(mod)
+        ivy_parser.get_parser()
+        parser_versions[version] = [dict(mod.__dict__) for mod in mods]
+
+def read_module(f,nested=False):
     from . import ivy_parser
     header = f.readline()
     s = '\n' + f.read() # newline at beginning to preserve line numbers
@@ -2279,10 +2305,7 @@ def read_module(f,nested=False):
                 if nested:
                     raise IvyError(None,'#lang ivy{} expected in included file'.format(old_version)) 
     #            print "version: {}, old_version: {}".format(version,old_version)
-                clear_rules('ivy_logic_parser')
-                clear_rules('ivy_parser')
-                importlib.reload(ivy_logic_parser)
-                importlib.reload(ivy_parser)
+                set_parser_version(version,old_version)
         ivy_parser.importer = import_module
         decls = parse(s,nested)
     elif header == '//lang dafny1':
@@ -2305,12 +2328,146 @@ def import_module(name):
             f = open(fname,'r')
         except Exception:
             raise IvyError(None,"module {} not found in current directory or module path".format(name))
+    from . import ivy_parser
     with iu.SourceFile(fname):
-        mod = read_module(f,nested=True)
+        # parent_object "this" means we are called by an include
+        if opt_parse_cache.get() and ivy_parser.parent_object == "this":
+            mod = cached_read_module(fname,f)
+        else:
+            mod = read_module(f,nested=True)
+    return mod
+
+# Persistent cache of parsed included files. When the parameter
+# parse_cache names a directory, the result of parsing an included
+# file is stored there, keyed by a hash of the file's path and
+# contents, the language version and the parser's source code. The
+# entry also holds the dependencies of the parse on its context (see
+# IncludeContext in ivy_parser) and the values of the counters used to
+# number labels and actions before and after the parse, so that a
+# cached file is loaded only when parsing it again would give the same
+# result. Otherwise, the file is parsed and the entry replaced.
+
+opt_parse_cache = iu.Parameter("parse_cache","")
+
+parse_cache_stats = {'hits' : 0, 'misses' : 0}
+
+parse_code_hash = None
+
+def parse_cache_key(fname,text):
+    global parse_code_hash
+    from . import ivy_parser, ivy_logic_parser, ivy_lexer
+    if parse_code_hash is None:
+        h = hashlib.sha256(sys.version.encode())
+        for mod in [ivy_parser,ivy_logic_parser,ivy_lexer,ivy_ast,ia,sys.modules[__name__]]:
+            with open(mod.__file__,'rb') as f:
+                h.update(f.read())
+        parse_code_hash = h.hexdigest()
+    h = hashlib.sha256(parse_code_hash.encode())
+    for x in [os.path.abspath(fname),fname,iu.get_string_version(),str(ia.check_unprovable.get()),text]:
+        h.update(x.encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+def parse_counters():
+    from . import ivy_parser
+    return (ivy_ast.lf_counter,ivy_parser.label_counter,ia.choice_action_ctr,
+            ia.local_action_ctr,ia.call_action_ctr)
+
+def set_parse_counters(counters):
+    from . import ivy_parser
+    (ivy_ast.lf_counter,ivy_parser.label_counter,ia.choice_action_ctr,
+     ia.local_action_ctr,ia.call_action_ctr) = counters
+
+def parse_context_matches(entry):
+    from . import ivy_parser as ip
+    if (ip.special_attribute,ip.global_attribute,ip.common_attribute) != (None,None,None):
+        return False
+    for name,origin in entry['modules'].items():
+        res = ip.stack_lookup(name)
+        if (ip.module_origins[id(res)][1] if id(res) in ip.module_origins else None) != origin:
+            return False
+    if any(ip.stack_action_lookup(name)[0] is not None for name in entry['actions']):
+        return False
+    if any(ip.stack_included(name) != val for name,val in entry['includes'].items()):
+        return False
+    defined = ip.stack[-1].defined
+    for name in entry['probed']:
+        ip.note_defined(defined,name)
+    return not any(name in defined for name in entry['probed'])
+
+def parse_cache_load(data):
+    from . import ivy_parser as ip
+    entry = pickle.loads(data)
+    if entry['counters'][0] != parse_counters() or not parse_context_matches(entry):
+        return None
+    decls,included,modules,defined,origins = pickle.loads(entry['body'])
+    origin = hashlib.sha256(data).hexdigest()
+    mod = Ivy()  # shares the scope of the including file, as in parsing
+    mod.decls,mod.included,mod.modules = decls,included,modules
+    mod.defined.update(defined)
+    for name,m in modules.items():
+        ip.module_origins[id(m)] = (m,origins.get(name) or origin)
+    ip.stack.append(mod)  # the includer pops the frame of the included file
+    set_parse_counters(entry['counters'][1])
+    return mod
+
+def parse_cache_store(path,ctx,mod,counters):
+    from . import ivy_parser as ip
+    defined = dict((name,mod.defined[name]) for name in ctx.probed if name in mod.defined)
+    origins = dict((name,ip.module_origins.get(id(m),(None,None))[1]) for name,m in mod.modules.items())
+    try:
+        body = pickle.dumps((mod.decls,mod.included,mod.modules,defined,origins),pickle.HIGHEST_PROTOCOL)
+    except (pickle.PicklingError,RecursionError):
+        return
+    entry = {'counters' : (counters,parse_counters()), 'modules' : ctx.modules,
+             'actions' : ctx.actions, 'includes' : ctx.includes, 'probed' : ctx.probed,
+             'body' : body}
+    data = pickle.dumps(entry,pickle.HIGHEST_PROTOCOL)
+    try:
+        os.makedirs(os.path.dirname(path),exist_ok=True)
+        tmp = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp,'wb') as f:
+            f.write(data)
+        os.replace(tmp,path)
+    except OSError:
+        return
+    origin = hashlib.sha256(data).hexdigest()
+    for name,m in mod.modules.items():
+        ip.module_origins[id(m)] = (m,origins[name] or origin)
+
+def cached_read_module(fname,f):
+    from . import ivy_parser as ip
+    text = f.read()
+    path = os.path.join(opt_parse_cache.get(),parse_cache_key(fname,text))
+    try:
+        with open(path,'rb') as cf:
+            data = cf.read()
+    except IOError:
+        data = None
+    if data is not None:
+        try:
+            mod = parse_cache_load(data)
+        except Exception:
+            mod = None
+        if mod is not None:
+            parse_cache_stats['hits'] += 1
+            return mod
+    parse_cache_stats['misses'] += 1
+    ctx = ip.IncludeContext(ip.stack[-1].defined)
+    counters = parse_counters()
+    ip.include_contexts.append(ctx)
+    try:
+        mod = read_module(io.StringIO(text),nested=True)
+    finally:
+        ip.include_contexts.pop()
+    if ctx.cacheable and not mod.attributes:
+        parse_cache_store(path,ctx,mod,counters)
     return mod
 
 def ivy_load_file(f,**kwargs):
     decls = read_module(f)
+    if opt_parse_cache.get():
+        print('parse cache: {} hits, {} misses'.format(parse_cache_stats['hits'],parse_cache_stats['misses']))
     ivy_compile(decls,**kwargs)
 
 def ivy_from_string(string,**kwargs):
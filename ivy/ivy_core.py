@@ -3,25 +3,28 @@
 #
 # TODO get rid of import *
 
+import time
+
 from ivy.z3 import *
 from . import ivy_utils as iu
 
 def get_id(x):
     return Z3_get_ast_id(x.ctx_ref(), x.as_ast())
 
-def biased_core(s,alits,unlikely):
+def biased_core(s,alits,unlikely,timeout=None):
     """ Try to produce a minimal unsatisfiable subset of alits, using as few
-    of the alits in unlikely as possible. 
+    of the alits in unlikely as possible. The last check of s must
+    have been unsat.
     """
-    core = alits
-    for lit in unlikely:
-        test = [c for c in core if get_id(c) != get_id(lit)]
-        if s.check(test) == unsat:
-            core = test
-    is_sat = s.check(core)
-    assert is_sat == unsat
-    core = minimize_core(s)
-    return core
+    core = set(get_id(c) for c in s.unsat_core())
+    unlikely_ids = set(get_id(lit) for lit in unlikely)
+    likely = [c for c in alits if get_id(c) not in unlikely_ids and get_id(c) in core]
+    unlikely = [c for c in alits if get_id(c) in unlikely_ids]
+    if unlikely and s.check(likely) == unsat:
+        core = set(get_id(c) for c in s.unsat_core())
+        likely = [c for c in likely if get_id(c) in core]
+        unlikely = []
+    return minimize_core_qx(s,likely + unlikely,timeout)
     
 
 def minimize_core_aux2(s, core):
@@ -40,10 +43,82 @@ def minimize_core_aux2(s, core):
             core = [c for c in core if get_id(c) not in ids]
     return mus
 
-def minimize_core(s):
+# Cores are minimized with the QuickXplain algorithm (Junker,
+# AAAI 2004). Given background literals bg and candidates cands such
+# that bg+cands is unsat, the candidates are split in two halves c1
+# and c2. A minimal subset d2 of c2 is found such that bg+c1+d2 is
+# unsat, and then a minimal subset d1 of c1 such that bg+d2+d1 is
+# unsat. This takes O(k log(n/k)) checks for a core of k of n
+# literals, where linear deletion takes n. When a check is unsat, the
+# candidates not in its core are dropped (clause-set refinement). Of
+# the minimal cores, QuickXplain prefers one that avoids the literals
+# at the end of the list, which biased_core uses for the unlikely
+# literals.
+#
+# Sets of at most qx_leaf_size candidates are minimized by linear
+# deletion, starting from the end of the list. After refinement, most
+# candidates are usually in the core, and for such sets linear
+# deletion needs fewer checks.
+#
+# The option core_timeout sets a time budget in milliseconds (0 means
+# no limit). It is tested between checks. When it is exceeded, the
+# remaining candidates are kept, so the core is unsat, but possibly
+# not minimal.
+
+def is_nat(s):
+    return str(s).isdigit()
+
+opt_core_timeout = iu.Parameter("core_timeout",0,check=is_nat,process=int)
+
+qx_leaf_size = 16
+
+def linear_deletion(s,bg,cands,deadline):
+    mus = []
+    while cands:
+        if deadline is not None and time.time() > deadline:
+            return cands + mus
+        if s.check(bg + cands[:-1] + mus) == sat:
+            mus = cands[-1:] + mus
+            cands = cands[:-1]
+        else:
+            core = set(get_id(c) for c in s.unsat_core())
+            cands = [c for c in cands[:-1] if get_id(c) in core]
+    return mus
+
+def quickxplain(s,bg,delta,cands,deadline):
+    """ Return a pair (d,core), where d is a minimal subset of cands
+    such that bg+d is unsat, given that bg+cands is unsat. If delta
+    is true and bg alone is unsat, d is empty and core is the set of
+    ids of the unsat core of bg, else core is None.
+    """
+    if deadline is not None and time.time() > deadline:
+        return cands,None
+    if delta and s.check(bg) == unsat:
+        return [],set(get_id(c) for c in s.unsat_core())
+    if len(cands) <= qx_leaf_size:
+        return linear_deletion(s,bg,cands,deadline),None
+    mid = len(cands) // 2
+    c1,c2 = cands[:mid],cands[mid:]
+    d2,core = quickxplain(s,bg+c1,True,c2,deadline)
+    if core is not None:
+        c1 = [c for c in c1 if get_id(c) in core]
+    d1,_ = quickxplain(s,bg+d2,len(d2) > 0,c1,deadline)
+    return d1 + d2,None
+
+def minimize_core_qx(s,core,timeout=None):
+    """ Return a minimal unsatisfiable subset of core, which must be
+    unsat, within timeout milliseconds if not None.
+    """
+    if timeout is None:
+        timeout = opt_core_timeout.get()
+    deadline = time.time() + timeout / 1000.0 if timeout else None
+    mus,_ = quickxplain(s,[],False,list(core),deadline)
+    return mus
+
+def minimize_core(s,timeout=None):
     core = list(s.unsat_core())
 #    print "minimize_core: core = {}".format(core)
-    core = minimize_core_aux2(s, core)
+    core = minimize_core_qx(s, core, timeout)
 #    print "minimize_core: core = {}".format(core)
     return core
 
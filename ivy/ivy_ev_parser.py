@@ -149,9 +149,13 @@ class EventGen(object):
             for ev1 in self(ev.children):
                 yield ev1
 
+# The generators EventRevGen and EventFwdGen visit the events before
+# (after) address addr. If tops is given, only the top-level events
+# whose numbers are in tops are visited (see EventIndex.candidates).
+
 class EventRevGen(object):
-    def __init__(self,addr):
-        self.addr = addr
+    def __init__(self,addr,tops=None):
+        self.addr,self.tops = addr,tops
     def rec(self,things,addr,start=0):
         if addr != None:
             cs = addr.split('/',1)
@@ -164,6 +168,8 @@ class EventRevGen(object):
         else:
             num = len(things)
         for idx in range(num-1,-1,-1):
+            if start == 0 and self.tops is not None and idx not in self.tops:
+                continue
             thing = things[idx]
             for a,t in self.rec(thing.children,None,start=1):
                 yield str(idx+start)+'/'+a,t
@@ -173,8 +179,8 @@ class EventRevGen(object):
             yield ev
 
 class EventFwdGen(object):
-    def __init__(self,addr):
-        self.addr = addr
+    def __init__(self,addr,tops=None):
+        self.addr,self.tops = addr,tops
     def rec(self,things,addr,start=0):
         if addr != None:
             cs = addr.split('/',1)
@@ -186,6 +192,8 @@ class EventFwdGen(object):
         else:
             num = -1
         for idx in range(num+1,len(things)):
+            if start == 0 and self.tops is not None and idx not in self.tops:
+                continue
             thing = things[idx]
             yield str(idx+start),thing
             for a,t in self.rec(thing.children,None,start=1):
@@ -403,10 +411,11 @@ def p_error(token):
     else:
         report_error(ParseError(None,None,'unexpected end of input'));
 
-def parse(s):
+def parse(s,lineno=1):
     global error_list
     error_list = []
-    res = parser.parse(s)
+    lexer.lineno = lineno
+    res = parser.parse(s,lexer=lexer)
     if error_list:
         print(error_list)
         raise iu.ErrorList(error_list)
@@ -419,6 +428,352 @@ tabdir = os.path.dirname(os.path.abspath(__file__))
 parser = yacc.yacc(tabmodule='ev_parsetab',errorlog=yacc.NullLogger(),outputdir=tabdir)
 #parser = yacc.yacc(tabmodule='ev_parsetab',outputdir=tabdir)
 
+# Reading large event logs.
+#
+# The function parse builds the events of a whole log in memory. To
+# handle large logs, EventReader reads a log from a binary file one
+# top-level event at a time. It finds the extent of each top-level
+# event with a scanner that only tracks the nesting of brackets, and
+# parses the text of the event when it is needed. The scanner also
+# collects the names of the events at each nesting level (zero for a
+# top-level event) without parsing.
+#
+# An EventIndex is an index of a log, kept in a file next to the log
+# (with extension .idx), and rebuilt when the log changes. It gives
+# the position of each top-level event and, for each event name and
+# nesting level, the numbers of the top-level events that contain an
+# event with this name at this level. It can be used as a sequence of
+# the top-level events, which are parsed when accessed. Its method
+# select gives the events that may match a list of patterns, reading
+# only the top-level events that contain a matching name. For
+# example, this gives the same events as filter(EventGen()(evs),pats)
+# without parsing the whole log:
+#
+#     filter(EventIndex(fname).select(pats),pats)
+#
+# The index is written in segments, so that the memory used is
+# bounded, both when building the index and when querying it.
+
+import re
+import array
+import bisect
+import heapq
+import pickle
+import struct
+import collections
+
+_space_re = re.compile(br'\s*')
+_token_re = re.compile(br'[<>;{}()\[\],:]|"[^"\n]*"|[_a-zA-Z0-9\.\$\-]+|\*')
+_group_re = re.compile(br'[()\[\]{}"]')
+
+class _NeedInput(Exception):
+    pass
+
+def _next_token(buf,pos,eof):
+    """ Return the extent (start,end) of the first token at or after
+    pos, or None at end of input. """
+    pos = _space_re.match(buf,pos).end()
+    if pos == len(buf):
+        if eof:
+            return None
+        raise _NeedInput()
+    m = _token_re.match(buf,pos)
+    end = m.end() if m else pos + 1  # the parser reports illegal characters
+    if end == len(buf) and not eof:
+        raise _NeedInput()
+    return pos,end
+
+def _skip_group(buf,pos,eof):
+    """ Return the position after the bracket that closes a group
+    opened just before pos. """
+    depth = 1
+    while depth:
+        m = _group_re.search(buf,pos)
+        if m is None:
+            if eof:
+                return len(buf)
+            raise _NeedInput()
+        pos = m.end()
+        if buf[m.start()] == ord('"'):
+            close = buf.find(b'"',pos)
+            if close < 0 and not eof:
+                raise _NeedInput()
+            if close >= 0 and b'\n' not in buf[pos:close]:
+                pos = close + 1
+        elif buf[m.start()] in b'([{':
+            depth += 1
+        else:
+            depth -= 1
+    return pos
+
+def _scan_event(buf,pos,eof):
+    """ Scan the top-level event at or after pos. Return a triple
+    (start,end,names), where names is the set of pairs (name,level)
+    of the events it contains, or None at end of input. """
+    tok = _next_token(buf,pos,eof)
+    if tok is None:
+        return None
+    start = end = tok[0]
+    names = set()
+    level = 0
+    state = 'start'
+    while tok is not None:
+        s,e = tok
+        t = buf[s:e]
+        if state == 'start':
+            if t in (b'<',b'>'):
+                state = 'name'
+            elif t == b'}' and level > 0:
+                level -= 1
+                if level == 0:
+                    return start,e,names
+            else:
+                names.add((t.decode('utf-8','replace'),level))
+                state = 'head'
+        elif state == 'name':
+            names.add((t.decode('utf-8','replace'),level))
+            state = 'head'
+        else:
+            if t == b'(' and state == 'head':
+                e = _skip_group(buf,e,eof)
+                state = 'args'
+            elif t == b';':
+                state = 'start'
+                if level == 0:
+                    return start,e,names
+            elif t == b'{':
+                level += 1
+                state = 'start'
+            elif level == 0:
+                return start,end,names
+            else:
+                state = 'start'
+                continue
+        end = e
+        tok = _next_token(buf,e,eof)
+    return start,end,names
+
+def parse_event(s,lineno=1):
+    """ Parse the text of a single event """
+    evs = parse(s,lineno)
+    if len(evs) != 1:
+        raise iu.IvyError(None,'line {}: expected one event'.format(lineno))
+    return evs[0]
+
+class EventReader(object):
+    """ Reads the top-level events of a log from a binary file f,
+    starting at the current position. """
+    chunk_size = 1 << 20
+    def __init__(self,f,lineno=1):
+        self.f = f
+        self.lineno = lineno
+    def scan(self):
+        """ Yield a tuple (offset,text,lineno,names) for each
+        top-level event, where text is the bytes of the event and names
+        is the set of pairs (name,level) of the events it contains. """
+        buf = b''
+        base = self.f.tell()
+        pos = 0
+        lineno = self.lineno
+        eof = False
+        while True:
+            try:
+                res = _scan_event(buf,pos,eof)
+            except _NeedInput:
+                data = self.f.read(max(self.chunk_size,len(buf)))
+                if data:
+                    buf = buf[pos:] + data
+                    base += pos
+                    pos = 0
+                else:
+                    eof = True
+                continue
+            if res is None:
+                return
+            start,end,names = res
+            lineno += buf.count(b'\n',pos,start)
+            yield base + start,buf[start:end],lineno,names
+            lineno += buf.count(b'\n',start,end)
+            pos = end
+    def __iter__(self):
+        for offset,text,lineno,names in self.scan():
+            yield parse_event(text.decode('utf-8','replace'),lineno)
+
+class EventIndex(object):
+    """ An index of the event log in file fname (see above) """
+    magic = b'IVYEVIDX1'
+    flush_size = 1 << 18   # number of entries held in memory while building
+    cache_size = 256       # number of parsed top-level events kept
+    def __init__(self,fname,idxname=None):
+        self.fname = fname
+        self.idxname = idxname or fname + '.idx'
+        self.cache = collections.OrderedDict()
+        self.segment = None
+        if not self.load():
+            self.build()
+            if not self.load():
+                raise iu.IvyError(None,'cannot read index {}'.format(self.idxname))
+
+    def source_stamp(self):
+        st = os.stat(self.fname)
+        return st.st_size,st.st_mtime
+
+    def load(self):
+        try:
+            with open(self.idxname,'rb') as f:
+                if f.read(len(self.magic)) != self.magic:
+                    return False
+                f.seek(-8,os.SEEK_END)
+                f.seek(struct.unpack('<q',f.read(8))[0])
+                self.dir = pickle.load(f)
+        except (IOError,OSError,EOFError,pickle.UnpicklingError,struct.error):
+            return False
+        if self.dir['stamp'] != self.source_stamp():
+            return False
+        self.starts = []
+        count = 0
+        for pos,n in self.dir['offsets']:
+            self.starts.append(count)
+            count += n
+        self.count = count
+        return True
+
+    def build(self):
+        """ Scan the log and write the index """
+        offsets = array.array('q')
+        postings = collections.defaultdict(lambda: array.array('q'))
+        dir = {'stamp' : self.source_stamp(), 'offsets' : [], 'postings' : collections.defaultdict(list)}
+        def write(f,arr):
+            pos = f.tell()
+            f.write(arr.tobytes())
+            return pos,len(arr)
+        def flush(f):
+            if offsets:
+                pos,n = write(f,offsets)
+                dir['offsets'].append((pos,n//3))
+                del offsets[:]
+            for key,arr in postings.items():
+                dir['postings'][key].append(write(f,arr))
+            postings.clear()
+        tmpname = self.idxname + '.tmp'
+        try:
+            with open(self.fname,'rb') as log, open(tmpname,'wb') as f:
+                f.write(self.magic)
+                size = 0
+                for num,(offset,text,lineno,names) in enumerate(EventReader(log).scan()):
+                    offsets.extend((offset,len(text),lineno))
+                    for key in names:
+                        postings[key].append(num)
+                    size += 3 + len(names)
+                    if size >= self.flush_size:
+                        flush(f)
+                        size = 0
+                flush(f)
+                pos = f.tell()
+                dir['postings'] = dict(dir['postings'])
+                pickle.dump(dir,f,protocol=2)
+                f.write(struct.pack('<q',pos))
+            os.replace(tmpname,self.idxname)
+        except (IOError,OSError) as err:
+            raise iu.IvyError(None,'cannot write index {}: {}'.format(self.idxname,err))
+
+    def record(self,num):
+        """ Return the (offset,length,lineno) of top-level event num """
+        idx = bisect.bisect_right(self.starts,num) - 1
+        if self.segment is None or self.segment[0] != idx:
+            pos,n = self.dir['offsets'][idx]
+            arr = array.array('q')
+            with open(self.idxname,'rb') as f:
+                f.seek(pos)
+                arr.frombytes(f.read(n * 3 * arr.itemsize))
+            self.segment = (idx,arr)
+        i = 3 * (num - self.starts[idx])
+        return tuple(self.segment[1][i:i+3])
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self,num):
+        if num < 0:
+            num += self.count
+        if num < 0 or num >= self.count:
+            raise IndexError(num)
+        if num in self.cache:
+            self.cache.move_to_end(num)
+            return self.cache[num]
+        offset,length,lineno = self.record(num)
+        with open(self.fname,'rb') as f:
+            f.seek(offset)
+            text = f.read(length)
+        with iu.SourceFile(self.fname):
+            res = parse_event(text.decode('utf-8','replace'),lineno)
+        self.cache[num] = res
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return res
+
+    def __iter__(self):
+        with open(self.fname,'rb') as f, iu.SourceFile(self.fname):
+            for ev in EventReader(f):
+                yield ev
+
+    def names(self):
+        """ Return the set of pairs (name,level) of the indexed events """
+        return set(self.dir['postings'])
+
+    def postings(self,key):
+        with open(self.idxname,'rb') as f:
+            for pos,n in self.dir['postings'].get(key,[]):
+                arr = array.array('q')
+                f.seek(pos)
+                arr.frombytes(f.read(n * arr.itemsize))
+                for num in arr:
+                    yield num
+
+    def keys(self,pats,level=None):
+        """ Return the keys (name,level) of the events that may match
+        one of pats, or None if any event may match. """
+        if any(pat.rep == '*' for pat in pats):
+            return None
+        return [key for key in self.dir['postings']
+                if (level is None or key[1] == level)
+                and any(key[0].startswith(pat.rep) for pat in pats)]
+
+    def candidates(self,pats,level=None):
+        """ Yield in order the numbers of the top-level events that
+        may contain an event matching one of pats. """
+        keys = self.keys(pats,level)
+        if keys is None:
+            for num in range(self.count):
+                yield num
+            return
+        last = None
+        for num in heapq.merge(*[self.postings(key) for key in keys]):
+            if num != last:
+                yield num
+                last = num
+
+    def select(self,pats,level=None):
+        """ Yield in order the events at the given level (default any)
+        that may match one of pats, as EventGen would. """
+        for num in self.candidates(pats,level):
+            evs = [self[num]]
+            if level is None:
+                for ev in EventGen()(evs):
+                    yield ev
+            else:
+                for ev in events_at_level(evs,level):
+                    yield ev
+
+def events_at_level(evs,level):
+    for ev in evs:
+        if level == 0:
+            yield ev
+        else:
+            for ev1 in events_at_level(ev.children,level-1):
+                yield ev1
+
+
 if __name__ == '__main__':
     while True:
        try:
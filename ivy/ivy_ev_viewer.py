@@ -53,7 +53,11 @@ class EventTree(tkinter.tix.Tree,uu.WithMenuBar):
         ask_pat(self,self.do_filter,"Filter")
 
     def do_filter(self,pat_evs):
-        result = list(ev.filter(ev.EventGen()(self.evs),pat_evs))
+        if isinstance(self.evs,ev.EventIndex):
+            evs = self.evs.select(pat_evs)
+        else:
+            evs = ev.EventGen()(self.evs)
+        result = list(ev.filter(evs,pat_evs))
         self.notebook.new_sheet(list(result))
 
     def find_reverse(self):
@@ -69,7 +73,8 @@ class EventTree(tkinter.tix.Tree,uu.WithMenuBar):
         sel = self.hlist.info_selection()
         anchor_addr = sel[0] if len(sel) else None
         anchor_ev = lookup(self.evs,anchor_addr) if anchor_addr else None
-        res = ev.find(gen(anchor_addr)(self.evs),pats,anchor=anchor_ev)
+        tops = set(self.evs.candidates(pats)) if isinstance(self.evs,ev.EventIndex) else None
+        res = ev.find(gen(anchor_addr,tops)(self.evs),pats,anchor=anchor_ev)
         if res == None:
             uu.ok_dialog(the_ui.tk,self,'Pattern not found')
             return
@@ -238,17 +243,14 @@ def main():
         usage()
         exit(1)
     fn = sys.argv[1]
-    import chardet # $ pip install chardet
-    try:
-        f = open(fn,'r')
-    except:
+    if not os.path.isfile(fn):
         print("not found: %s" % fn)
         sys.exit(1)
 
+    # the log is read through an index (see ivy_ev_parser.EventIndex)
     with iu.ErrorPrinter():
         with iu.SourceFile(fn):
-            s = f.read()
-            evs = ev.parse(s)
+            evs = ev.EventIndex(fn)
     global tk
     tk = tkinter.tix.Tk()
     RunSample(tk,evs)
@@ -1628,7 +1628,7 @@ def create_isolate(iso,mod = None,**kwargs):
                     for called in im.module.actions[actname].iter_calls():
                         if called not in present_actions:
                             outcalls.add(called)
-            for name in outcalls:
+            for name in sorted(outcalls):
                 impname = name
                 extname = 'imp__' + impname
                 if impname in implementation_map:
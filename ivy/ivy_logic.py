@@ -71,6 +71,14 @@ from .type_inference import concretize_sorts, concretize_terms, SortVar
 from collections import defaultdict
 from itertools import chain
 from . import ivy_smtlib
+from .utils.recstruct_object import set_hash_consing
+
+# If true, structurally equal terms and formulas are shared (see
+# recstruct_object). This must be set before any terms are built to
+# be effective, so it is only useful as a command line option.
+
+opt_hash_cons = iu.BooleanParameter("hash_cons",False)
+opt_hash_cons.set_callback(set_hash_consing)
 
 allow_unsorted = False
 repr = str
@@ -21,6 +21,9 @@ from collections import defaultdict
 import itertools
 import sys
 import os
+import time
+import signal
+import random
 
 logfile = None
 verbose = False
@@ -49,6 +52,8 @@ class Aiger(object):
         self.latches = latches
         self.outputs = outputs
         self.gates = []
+        self.strash = dict()  # structural hashing: (in0,in1) -> gate literal
+        self.naive_gates = 0  # number of gates without hashing or rewriting
         self.map = dict()
         self.next_id = 1
         self.values = dict()
@@ -69,17 +74,49 @@ class Aiger(object):
     def define(self,sym,val):
 #        print 'define: {} = {}'.format(sym,val)
         self.map[sym] = val
-        
+
+    # Make a two-input AND gate, with constant propagation and
+    # structural hashing, so that identical gates are shared.
+
+    def and2(self,x,y):
+        if x > y:
+            x,y = y,x
+        if x == 0 or x == y ^ 1:
+            return 0
+        if x == 1 or x == y:
+            return y
+        key = (x,y)
+        res = self.strash.get(key)
+        if res is None:
+            res = self.next_id * 2
+            self.gates.append((res,y,x))
+            self.next_id += 1
+            self.strash[key] = res
+        return res
+
+    # An n-ary AND is built as a balanced tree of two-input gates,
+    # after removing duplicate and constant arguments.
+
     def andl(self,*args):
         if not args:
             return self.true()
-        res = args[0]
-        for x in args[1:]:
-            tmp = self.next_id * 2
-            self.gates.append((tmp,res,x))
-            self.next_id += 1
-            res = tmp
-        return res
+        self.naive_gates += len(args) - 1
+        lits = []
+        seen = set()
+        for x in args:
+            if x == 0 or (x ^ 1) in seen:
+                return 0
+            if x != 1 and x not in seen:
+                seen.add(x)
+                lits.append(x)
+        if not lits:
+            return self.true()
+        while len(lits) > 1:
+            pairs = [self.and2(lits[i],lits[i+1]) for i in range(0,len(lits)-1,2)]
+            if len(lits) % 2:
+                pairs.append(lits[-1])
+            lits = pairs
+        return lits[0]
 
     def notl(self,arg):
         return 2*(arg//2) + (1 - arg%2)
@@ -88,9 +125,15 @@ class Aiger(object):
         return self.notl(self.andl(*list(map(self.notl,args))))
 
     def ite(self,x,y,z):
+        if x < 2 or y == z:
+            self.naive_gates += 3
+            return y if x == 1 or y == z else z
         return self.orl(self.andl(x,y),self.andl(self.notl(x),z))
 
     def iff(self,x,y):
+        if x == y or x == self.notl(y):
+            self.naive_gates += 3
+            return self.true() if x == y else self.false()
         return self.orl(self.andl(x,y),self.andl(self.notl(x),self.notl(y)))
 
     def implies(self,x,y):
@@ -157,6 +200,33 @@ class Aiger(object):
         for x,y,z in self.gates:
             strings.append(str('{} {} {}'.format(x,y,z)))
         return '\n'.join(strings)+'\n'
+
+    # Write the binary AIGER format to a file opened in binary
+    # mode. This requires inputs, latches and gates to be numbered
+    # consecutively in that order, and each gate's inputs to be less
+    # than its output, which is how we construct them. Gates are
+    # written as delta-encoded pairs of inputs, in chunks to avoid
+    # building the whole file in memory.
+
+    def write_binary(self,f,chunk_size=1 << 16):
+        f.write('aig {} {} {} {} {}\n'.format(self.next_id - 1,len(self.inputs),
+                                              len(self.latches),len(self.outputs),
+                                              len(self.gates)).encode('ascii'))
+        for x in self.latches:
+            f.write('{}\n'.format(self.values[x]).encode('ascii'))
+        for x in self.outputs:
+            f.write('{}\n'.format(self.values[x]).encode('ascii'))
+        buf = bytearray()
+        for x,y,z in self.gates:
+            for delta in (x - y, y - z):
+                while delta >= 0x80:
+                    buf.append((delta & 0x7f) | 0x80)
+                    delta >>= 7
+                buf.append(delta)
+            if len(buf) >= chunk_size:
+                f.write(buf)
+                buf = bytearray()
+        f.write(buf)
                                           
     def sym_vals(self,syms):
         for sym in syms:
@@ -176,32 +246,37 @@ class Aiger(object):
         print('state: {}'.format(self.latch_vals()))
         
     def reset(self):
-        self.state = dict((self.map[x],'0') for x in self.latches)
+        self.sim = AigerSim(self)
 
     def getin(self,gi):
-        if gi == 0:
-            return '0'
-        if gi == 1:
-            return '1'
-        v = self.state[gi & ~1]
-        return ('0' if v == '1' else '1') if (gi & 1) else v
+        return '1' if self.sim.lit(gi) & 1 else '0'
 
     def step(self,inp):
         assert len(inp) == len(self.inputs)
-        for x,y in zip(self.inputs,inp):
-            self.state[self.map[x]] = y
-#        print 'input: {}'.format(self.sym_vals(self.inputs))
-        for out,in0,in1 in self.gates:
-            res = '1' if (self.getin(in0) == '1' and self.getin(in1) == '1') else '0'
-            self.state[out] = res
-#            print 'gate {}: {}'.format(out,res)
-#        print 'outputs: {}'.format(''.join(self.getin(self.values[x]) for x in self.outputs))
+        self.sim.step([1 if x == '1' else 0 for x in inp])
 
     def __next__(self):
-        for lt in self.latches:
-            self.state[self.map[lt]] = self.getin(self.values[lt])
-#        self.show_state()
-
+        self.sim.latch_next()
+
+    def output_vals(self):
+        return self.sym_next_vals(self.outputs)
+
+    def write_witness(self,f,inps):
+        """ Write a witness in the format read by
+        aiger_witness_to_ivy_trace2, given a sequence of input
+        strings starting from the reset state. """
+        self.reset()
+        f.write('1\n')
+        for inp in inps:
+            pre = self.latch_vals()
+            self.step(inp)
+            out = self.output_vals()
+            next(self)
+            f.write('{} {} {} {}\n'.format(pre,inp,out,self.latch_vals()))
+
+    def stats(self):
+        return 'aiger: {} and gates ({} before structural hashing and rewriting)'.format(
+            len(self.gates),self.naive_gates)
 
     def debug(self):
         print('inputs: {}'.format([str(x) for x in self.inputs]))
@@ -218,6 +293,65 @@ class Aiger(object):
 
         
             
+# Bit-parallel simulation of an Aiger circuit. Each signal is held in
+# a Python int used as a bit vector, so that "width" input vectors are
+# simulated in one pass over the gates. Values are indexed by variable
+# (literal // 2), and gates are evaluated in creation order, which is
+# topological. The complement bit of a literal is stored as a mask 0
+# or -1 to be xor'ed with the variable value.
+
+class AigerSim(object):
+    def __init__(self,aiger,width=1):
+        self.width = width
+        self.mask = (1 << width) - 1
+        self.inputs = [aiger.map[x] >> 1 for x in aiger.inputs]
+        self.latches = [aiger.map[x] >> 1 for x in aiger.latches]
+        self.nexts = [aiger.values[x] for x in aiger.latches]
+        self.outputs = [aiger.values[x] for x in aiger.outputs]
+        self.gates = [(out >> 1,in0 >> 1,-(in0 & 1),in1 >> 1,-(in1 & 1))
+                      for out,in0,in1 in aiger.gates]
+        self.vals = [0] * aiger.next_id
+
+    def lit(self,gi):
+        return (self.vals[gi >> 1] ^ -(gi & 1)) & self.mask
+
+    def step(self,inps):
+        vals,mask = self.vals,self.mask
+        for v,x in zip(self.inputs,inps):
+            vals[v] = x
+        for out,in0,c0,in1,c1 in self.gates:
+            vals[out] = (vals[in0] ^ c0) & (vals[in1] ^ c1) & mask
+
+    def latch_next(self):
+        nexts = [self.lit(x) for x in self.nexts]
+        for v,x in zip(self.latches,nexts):
+            self.vals[v] = x
+
+    def bad(self):
+        res = 0
+        for x in self.outputs:
+            res |= self.lit(x)
+        return res
+
+def random_simulate(aiger,depth,width=256,seed=0):
+    """ Simulate the circuit from the reset state on "width" random
+    input sequences of length "depth". If an output becomes true,
+    return the shortest sequence of input strings reaching it, else
+    None. """
+    rng = random.Random(seed)
+    sim = AigerSim(aiger,width)
+    frames = []
+    for k in range(depth):
+        inps = [rng.getrandbits(width) for x in sim.inputs]
+        frames.append(inps)
+        sim.step(inps)
+        bad = sim.bad()
+        if bad:
+            bit = (bad & -bad).bit_length() - 1
+            return [''.join(str((x >> bit) & 1) for x in inps) for inps in frames]
+        sim.latch_next()
+    return None
+
 # functions for binary encoding of finite sorts
 
 def ceillog2(n):
@@ -380,6 +514,9 @@ class Encoder(object):
     def __str__(self):
         return str(self.sub)
 
+    def write_binary(self,f):
+        self.sub.write_binary(f)
+
     def gebin(self,bits,n):
         if n == 0:
             return self.sub.true()
@@ -1668,20 +1805,136 @@ def aiger_witness_to_ivy_trace2(aiger,witnessfilename,action,stvarset,ext_act,an
 #        print 80*'-'
         return handler
 
+# Model checking backends. A backend is given a binary AIGER file
+# with a single output that is true in a bad state. It returns a
+# command line that runs the model checker, writing a witness in the
+# AIGER format if it finds a counterexample. The method "scrape" looks
+# at the output of the command and returns True if the property was
+# proved. Backends are registered by name in "model_checkers", and
+# selected with the "mc_engine" option or the isolate attribute of the
+# same name. A comma-separated list of names gives a portfolio: the
+# engines run in parallel and the first conclusive answer is used.
+
 class ModelChecker(object):
+    """ Base class of model checking backends. A backend provides the
+    methods cmd(aigfilename,outfilename) and scrape(alltext). """
     pass
 
+def abc_path():
+    return os.path.join(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'),'abc')
+
+# ABC reports a proof differently depending on the engine: the
+# property checking engines print "Property proved", while dprove,
+# which checks equivalence with a constant-false output, prints
+# "Networks are equivalent".
+
+abc_proved_messages = {
+    'dprove' : ['Networks are equivalent'],
+}
+
 class ABCModelChecker(ModelChecker):
+    def __init__(self,engine='pdr'):
+        self.engine = engine
     def cmd(self,aigfilename,outfilename):
-        abc_path = os.path.join(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'),'abc')
         if verbose:
-            print("abc_path: {}".format(abc_path))
-        return [abc_path,'-c','read_aiger {}; pdr; write_aiger_cex  {}'.format(aigfilename,outfilename)]
+            print("abc_path: {}".format(abc_path()))
+        return [abc_path(),'-c','read_aiger {}; {}; write_aiger_cex  {}'.format(aigfilename,self.engine,outfilename)]
     def scrape(self,alltext):
-        return 'Property proved' in alltext
+        name = self.engine.split()[0] if self.engine.strip() else self.engine
+        return any(msg in alltext for msg in abc_proved_messages.get(name,['Property proved']))
+
+model_checkers = dict()
+
+def register_model_checker(name,factory):
+    model_checkers[name] = factory
+
+for engine in ['pdr','bmc3','int','dprove']:
+    register_model_checker(engine,lambda engine=engine: ABCModelChecker(engine))
+
+opt_mc_engine = iu.Parameter("mc_engine","")
+opt_mc_sim = iu.Parameter("mc_sim",0,check=lambda s: s.isdigit(),process=int)
+
+def get_model_checker(name):
+    """ Get a model checker by name. The name abc:<command> gives an
+    ABC engine with arbitrary options. """
+    if name.startswith('abc:'):
+        return ABCModelChecker(name[4:])
+    if name not in model_checkers:
+        raise iu.IvyError(None,'unknown model checker "{}" (known: {})'.format(
+            name,', '.join(sorted(model_checkers))))
+    return model_checkers[name]()
+
+def get_model_checkers(spec):
+    """ Get a list of (name,model checker) pairs from a specification
+    such as "pdr,bmc3". The default is pdr. """
+    if spec.startswith('"'):
+        spec = spec[1:-1]
+    names = [x.strip() for x in spec.split(',') if x.strip()] or ['pdr']
+    return [(name,get_model_checker(name)) for name in names]
+
+def witness_found(outfilename):
+    try:
+        with open(outfilename,'r') as f:
+            return f.readline().strip() == '1'
+    except IOError:
+        return False
 
+def run_model_checkers(mcs,aigfilename,outfilename):
+    """ Run the model checkers mcs in parallel on aigfilename. Returns
+    a pair (proved,witness file) for the first conclusive result and
+    kills the remaining processes. A model checker is conclusive if it
+    proves the property or writes a witness. """
+    procs = []
+    try:
+        for idx,(name,mc) in enumerate(mcs):
+            outname = outfilename if len(mcs) == 1 else '{}.{}'.format(outfilename,idx)
+            log = tempfile.TemporaryFile()
+            try:
+                p = subprocess.Popen(mc.cmd(aigfilename,outname),stdout=log,
+                                     start_new_session=hasattr(os,'killpg'))
+            except:
+                raise iu.IvyError(None,'failed to run model checker {}'.format(name))
+            procs.append((name,mc,outname,log,p))
+        running = list(procs)
+        while running:
+            for proc in list(running):
+                name,mc,outname,log,p = proc
+                ret = p.poll()
+                if ret is None:
+                    continue
+                running.remove(proc)
+                log.seek(0)
+                alltext = log.read().decode("utf-8")
+                if verbose:
+                    print('\nModel checker {} output:'.format(name))
+                    print(80*'-')
+                    sys.stdout.write(alltext)
+                    print(80*'-')
+                if ret != 0:
+                    if len(mcs) == 1:
+                        raise iu.IvyError(None,'model checker returned non-zero status')
+                    continue
+                if mc.scrape(alltext):
+                    return True,outname
+                if witness_found(outname):
+                    if len(mcs) > 1 and verbose:
+                        print('counterexample found by {}'.format(name))
+                    return False,outname
+            if running:
+                time.sleep(0.05)
+        raise iu.IvyError(None,'model checker inconclusive: {}'.format(
+            ', '.join(name for name,mc in mcs)))
+    finally:
+        for name,mc,outname,log,p in procs:
+            if p.poll() is None:
+                if hasattr(os,'killpg'):
+                    os.killpg(p.pid,signal.SIGKILL)  # also kill any children
+                else:
+                    p.kill()
+                p.wait()
+            log.close()
 
-def check_isolate(method="mc"):
+def check_isolate(method="mc",engines=None):
     
     if verbose:
         print()
@@ -1704,69 +1957,33 @@ def check_isolate(method="mc"):
 
     aiger,decoder,annot,cnsts,action,stvarset = to_aiger(mod,ext_act,method=method)
 #    print aiger
+    logfile.write('\n{}\n'.format(aiger.sub.stats()))
+    if verbose:
+        print(aiger.sub.stats())
 
-    # output aiger to temp file
-
-    with tempfile.NamedTemporaryFile(mode='wt', suffix='.aag',delete=False) as f:
-        name = f.name
-#        print 'file name: {}'.format(name)
-        f.write(str(aiger))
-    
-    # convert aag to aig format
+    # output aiger to temp file in binary format
 
-    aigfilename = name.replace('.aag','.aig')
-    aigtoaig_path = os.path.join(os.path.join(os.path.dirname(os.path.abspath(__file__)),'bin'),'aigtoaig')
-    if verbose:
-        print("aigtoaig_path:{}".format(aigtoaig_path))
-    try:
-        ret = subprocess.call([aigtoaig_path,name,aigfilename])
-    except:
-        raise iu.IvyError(None,'failed to run aigtoaig')
-    if ret != 0:
-        raise iu.IvyError(None,'aigtoaig returned non-zero status')
+    with tempfile.NamedTemporaryFile(mode='wb', suffix='.aig',delete=False) as f:
+        aigfilename = f.name
+#        print 'file name: {}'.format(aigfilename)
+        aiger.write_binary(f)
         
     # run model checker
 
-    outfilename = name.replace('.aag','.out')
-    mc = ABCModelChecker() # TODO: make a command-line option
-    cmd = mc.cmd(aigfilename,outfilename)
-#    print cmd
-    try:
-        p = subprocess.Popen(cmd,stdout=subprocess.PIPE)
-    except:
-        raise iu.IvyError(None,'failed to run model checker')
+    outfilename = aigfilename.replace('.aig','.out')
+    mcs = get_model_checkers(engines if engines is not None else opt_mc_engine.get())
 
-    # pass through the stdout and collect it in texts
+    # try random simulation first, to find shallow counterexamples cheaply
 
-    if verbose:
-        print('\nModel checker output:')
-        print(80*'-')
-    texts = []
-    while True:
-        text = p.stdout.read(256)
-        if verbose:
-            sys.stdout.write(text.decode("utf-8"))
-        texts.append(text)
-        if len(text) < 256:
-            break
-    alltext = ''.join(x.decode("utf-8") for x in texts)
-    if verbose:
-        print(80*'-')
-    
-    # get the model checker status
-
-    ret = p.wait()
-    if ret != 0:
-        raise iu.IvyError(None,'model checker returned non-zero status')
-
-    # scrape the output to get the answer
-
-    if mc.scrape(alltext):
+    wit = random_simulate(aiger.sub,opt_mc_sim.get()) if opt_mc_sim.get() else None
+    if wit is not None:
+        logfile.write('counterexample of length {} found by simulation\n'.format(len(wit)))
+        with open(outfilename,'w') as f:
+            aiger.sub.write_witness(f,wit)
+        proved = False
+    else:
+        proved,outfilename = run_model_checkers(mcs,aigfilename,outfilename)
+    if proved:
         return None
     else:
-        return aiger_witness_to_ivy_trace2(aiger,outfilename,action,stvarset,ext_act,annot,cnsts,decoder)        
-        
-    
-
-
-    
+        return aiger_witness_to_ivy_trace2(aiger,outfilename,action,stvarset,ext_act,annot,cnsts,decoder)
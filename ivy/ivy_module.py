@@ -97,12 +97,13 @@ class Module(object):
         self.old_sig = il.sig
         module = self
         il.sig = self.sig
-        ivy_solver.clear()   # this clears cached values, needed when changing sig
+        ivy_solver.clear_if_sig_changed()   # cached values depend on the sig
         return self
 
     def __exit__(self,exc_type, exc_val, exc_tb):
         global module
         module = self.old_module
+        ivy_solver.check_sig_on_exit()
         il.sig = self.old_sig
         return False # don't block any exceptions
 
@@ -108,22 +108,84 @@ def report_error(error):
 #    assert False,error
     error_list.append(error)
 
+# Included files may be cached by the compiler (see parse_cache in
+# ivy_compiler). Parsing an included file depends on its context,
+# however. Module and action names can be resolved in the including
+# files, an include is skipped if an including file already has it,
+# and the included file declares its names in the scope of the
+# including file. While an included file is parsed, an IncludeContext
+# records each of these lookups that reaches outside of the file, so
+# that a cached parse is used only where the lookups give the same
+# results. Lookups whose result cannot be compared in this way make
+# the parse uncacheable.
+#
+# The modules of cached files are identified by an origin (a hash of
+# the cache entry), in module_origins.
+
+class IncludeContext(object):
+    def __init__(self,defined):
+        self.depth = len(stack)    # stack index of the file's frame
+        self.defined = defined     # the scope in which the file declares
+        self.outer = set(defined)
+        self.probed = set()        # names of the scope looked up by the file
+        self.modules = dict()      # module name -> origin, or None if undefined
+        self.actions = set()       # action names undefined outside
+        self.includes = dict()     # include name -> included outside?
+        self.cacheable = True
+
+include_contexts = []
+module_origins = dict()   # id of module -> (module,origin)
+
+def outer_contexts(idx):
+    return [ctx for ctx in include_contexts if idx < ctx.depth]
+
+def note_defined(defined,name):
+    for ctx in include_contexts:
+        if defined is ctx.defined:
+            if name in ctx.outer:
+                ctx.cacheable = False
+            else:
+                ctx.probed.add(name)
+
 def stack_lookup(name):
-    for ivy in reversed(stack):
-        if name in ivy.modules:
-            return ivy.modules[name]
+    for idx in range(len(stack)-1,-1,-1):
+        if name in stack[idx].modules:
+            res = stack[idx].modules[name]
+            for ctx in outer_contexts(idx):
+                if id(res) in module_origins:
+                    ctx.modules.setdefault(name,module_origins[id(res)][1])
+                else:
+                    ctx.cacheable = False
+            return res
+    for ctx in include_contexts:
+        ctx.modules.setdefault(name,None)
     return None
 
 
 def stack_action_lookup(name,params=0):
-    for ivy in reversed(stack):
-        if ivy.is_module:
-            break
+    idx = len(stack)
+    while idx > 0 and not stack[idx-1].is_module:
+        idx -= 1
+        ivy = stack[idx]
         params += len(ivy.params)
         if name in ivy.actions:
+            for ctx in outer_contexts(idx):
+                ctx.cacheable = False
             return ivy.actions[name],params
+    for ctx in outer_contexts(idx):
+        ctx.actions.add(name)
     return None,0
 
+def stack_included(name):
+    for idx in range(len(stack)-1,-1,-1):
+        if name in stack[idx].included:
+            for ctx in outer_contexts(idx):
+                ctx.includes.setdefault(name,True)
+            return True
+    for ctx in include_contexts:
+        ctx.includes.setdefault(name,False)
+    return False
+
 def inst_mod(ivy,module,pref,subst,vsubst,modname=None,lineno=None):
     set_always_clone_with_fresh_id(True)
     if pref is not None and pref.rep in vsubst:
@@ -308,6 +370,8 @@ class Ivy(object):
         else:
             name,lineno = df
             cls = None
+        if include_contexts:
+            note_defined(self.defined,name)
         for x in self.defined[name]:
             olineno,ocls = x[0],x[1]
             conflict = ((ocls is not ObjectDecl) if cls is TypeDecl 
@@ -325,6 +389,8 @@ class Ivy(object):
         self.defined[name] = lineno
 
     def get_object_defined(self,name):
+        if include_contexts:
+            note_defined(self.defined,name)
         if name in self.defined:
             x = self.defined[name][0]
             if len(x) >= 3:
@@ -336,6 +402,8 @@ class Ivy(object):
         if defined is not None:
             defined = defaultdict(list,((k,v.copy()) for k,v in defined.items()))
 #        print 'set_object_defined: {}'.format(name)
+        if include_contexts:
+            note_defined(self.defined,name)
         if name in self.defined:
 #            print 'prev: {}'.format(self.defined[name])
             self.defined[name] = [(x[0],x[1],defined) for x in self.defined[name]]
@@ -370,7 +438,7 @@ def p_top_using_symbol(p):
 def p_top_include_symbol(p):
     'top : top INCLUDE SYMBOL'
     p[0] = p[1]
-    if not any(p[3] in m.included for m in stack):
+    if not stack_included(p[3]):
         p[0].included.add(p[3])
         pref = Atom(p[3],[])
         pref.lineno = get_lineno(p,2)
@@ -3066,10 +3134,20 @@ def p_error(token):
     # Stop here on any parse error to prevent this
     raise iu.ErrorList(error_list)
 
-# Build the parsers
+# Build the parsers. The grammar depends on the language version, so
+# the parser is built when first used, after the version is read from
+# the header of the file. The tables are stored in a module for each
+# version, so that using another version does not overwrite them.
 import os
 tabdir = os.path.dirname(os.path.abspath(__file__))
-parser = yacc.yacc(start='top',tabmodule='ivy_parsetab',errorlog=yacc.NullLogger(),outputdir=tabdir,debug=None)
+parser = None
+
+def get_parser():
+    global parser
+    if parser is None:
+        tabmodule = 'ivy{}_parsetab'.format(iu.get_string_version().replace('.','_'))
+        parser = yacc.yacc(start='top',tabmodule=tabmodule,errorlog=yacc.NullLogger(),outputdir=tabdir,debug=None)
+    return parser
 #parser = yacc.yacc(start='top',tabmodule='ivy_parsetab',outputdir=tabdir,debug=None)
 #parser = yacc.yacc(start='top',tabmodule='ivy_parsetab')
 # formula_parser = yacc.yacc(start = 'fmla', tabmodule='ivy_formulatab')
@@ -3126,7 +3204,7 @@ def parse(s,nested=False):
     vernum = iu.get_numeric_version()
     with LexerVersion(vernum):
         # shallow copy the parser and lexer to try for re-entrance (!!!)
-        res = copy.copy(parser).parse(s,lexer=copy.copy(lexer),tracking=True)
+        res = copy.copy(get_parser()).parse(s,lexer=copy.copy(lexer),tracking=True)
     if not nested:
         expand_autoinstances(res)
     if error_list:
@@ -7,6 +7,7 @@ from . import ivy_logic as il
 from . import ivy_logic_utils as lu
 from . import ivy_ast as ia
 from . import logic_util
+import importlib
 
 class Redefinition(iu.IvyError):
     pass
@@ -186,6 +187,8 @@ class ProofChecker(object):
 
     def tactic_tactic(self,decls,proof):
         tn = proof.tactic_name
+        if tn not in registered_tactics and tn in lazy_tactics:
+            importlib.import_module('.' + lazy_tactics[tn],__package__)
         if tn not in registered_tactics:
             raise iu.IvyError(proof,'unknown tactic: {}'.format(tn))
         tactic = registered_tactics[tn]
@@ -1649,5 +1652,10 @@ class RemoveSymbols(object):
 
 registered_tactics = dict()
 
+# Tactics of modules that are imported only when needed. This maps the
+# name of the tactic to the module that registers it.
+
+lazy_tactics = dict()
+
 def register_tactic(name,tactic):
     registered_tactics[name] = tactic
@@ -8,8 +8,12 @@ import encodings.latin_1
 import itertools
 from itertools import chain
 from collections import defaultdict
+import collections
 import re
 import functools
+import hashlib
+import os
+import time
 
 import ivy.z3 as z3
 from . import ivy_logic
@@ -226,11 +230,80 @@ def is_solver_op(name):
 
 
 def clear():
-    global z3_sorts, z3_predicates, z3_constants, z3_functions
+    global z3_sorts, z3_predicates, z3_constants, z3_functions, translation_sig
     z3_sorts = dict()
     z3_predicates = {ivy_logic.equals : my_eq}
     z3_constants = dict()
     z3_functions = dict()
+    translation_cache.clear()
+    translation_sig = None
+
+# Translation cache. The Z3 translations of compound formulas and terms
+# are kept in an LRU cache keyed on the identity of the Ivy object
+# (which the entry holds, so the id cannot be reused while the entry
+# lives). With hash_cons=true, structurally equal formulas are the
+# same object, so they share an entry. The translation depends on the
+# sorts and interpretations in the signature, so the cache (like the
+# caches of symbols above) is cleared when a module is entered with a
+# signature that differs in these, rather than on every module
+# entry. It also depends on the flags handle_range_sorts and
+# use_z3_enums, which are part of the key. The size of the cache is
+# set by option z3_cache_size (0 disables it) and the hit counts are
+# reported in the profile (see ivy_check).
+
+def is_nat_param(s):
+    return s.isdigit()
+
+opt_z3_cache_size = iu.Parameter("z3_cache_size",100000,check=is_nat_param,process=int)
+
+translation_cache = collections.OrderedDict()
+translation_counts = {'hits' : 0, 'misses' : 0, 'evictions' : 0}
+translation_sig = None
+
+def same_sig(sig):
+    if translation_sig is None:
+        return False
+    sorts,interp = translation_sig
+    return sig.sorts == sorts and sig.interp == interp
+
+def clear_if_sig_changed():
+    global translation_sig
+    sig = ivy_logic.sig
+    if not same_sig(sig):
+        clear()
+        translation_sig = (dict(sig.sorts),dict(sig.interp))
+
+# If the signature was modified while a module was active, the cached
+# translations may depend on the modification, so we must clear the
+# cache when the next module is entered, even if its signature matches.
+
+def check_sig_on_exit():
+    global translation_sig
+    if not same_sig(ivy_logic.sig):
+        translation_sig = None
+
+def translation_stats():
+    res = dict(translation_counts)
+    res['size'] = len(translation_cache)
+    return res
+
+def cached_translation(ast,translate):
+    limit = opt_z3_cache_size.get()
+    if limit == 0:
+        return translate(ast)
+    key = (id(ast),handle_range_sorts,use_z3_enums)
+    entry = translation_cache.get(key)
+    if entry is not None:
+        translation_counts['hits'] += 1
+        translation_cache.move_to_end(key)
+        return entry[1]
+    translation_counts['misses'] += 1
+    res = translate(ast)
+    translation_cache[key] = (ast,res)
+    if len(translation_cache) > limit:
+        translation_cache.popitem(last=False)
+        translation_counts['evictions'] += 1
+    return res
 
 clear()    
 
@@ -411,6 +484,11 @@ def enumerated_to_numeral(term):
 def term_to_z3(term):
     if ivy_logic.is_boolean(term) and not ivy_logic.is_variable(term):
         return formula_to_z3_int(term)
+    if term.args:
+        return cached_translation(term,translate_term)
+    return translate_term(term)
+
+def translate_term(term):
     if not term.args:
         if isinstance(term,ivy_logic.Variable):
             sorted = hasattr(term,'sort')
@@ -545,6 +623,7 @@ def conj_to_z3(cl):
     return formula_to_z3_closed(cl)
 
 def type_constraints(syms):
+    syms = sorted(syms,key=str)  # so that generated queries are reproducible
     natsyms = [s for s in syms
                if ivy_logic.sig.interp.get(s.sort.rng.name,None) == 'nat'
                   and not ivy_logic.is_interpreted_symbol(s)]
@@ -582,6 +661,9 @@ def clauses_to_z3(clauses):
     return res
 
 def formula_to_z3_int(fmla):
+    return cached_translation(fmla,translate_formula)
+
+def translate_formula(fmla):
 #    print "formula_to_z3_int: {} : {}".format(fmla,type(fmla))
     if isinstance(fmla,ivy_logic.Definition or ivy_logic.is_eq(fmla) or isinstance(fmla,ivy_logic.Iff)):
         if ivy_logic.is_true(fmla.args[1]):
@@ -1158,18 +1240,303 @@ def model_if_none(clauses1,implied,model):
     return h
 
 
-def decide(s,atoms=None):
+# Persistent cache of verification condition results. When the
+# parameter vc_cache names a directory, each checked condition is
+# keyed by a hash of the formulas it depends on and its assumptions,
+# together with the Z3 version and the solver options that affect the
+# result. The result (unsat or sat) is stored in a file named by the
+# key. An unsat result in the cache lets us skip the solver call.
+#
+# The formulas are by default the assertions of the solver. A solver
+# that is shared between checks (see Session) passes only the formulas
+# relevant to the check, so that the key does not depend on what was
+# checked before, or on the names of fresh literals.
+
+opt_vc_cache = iu.Parameter("vc_cache","")
+
+def vc_cache_key(fmlas,atoms=None):
+    h = hashlib.sha256()
+    h.update(z3.get_version_string().encode())
+    for param in ['smt.macro_finder','smt.random_seed']:
+        h.update('{}={};'.format(param,z3.get_param(param)).encode())
+    s = z3.Solver()   # to get the declarations of the formulas
+    for fmla in fmlas:
+        s.add(fmla)
+    h.update(s.sexpr().encode())
+    if atoms:
+        h.update(' '.join(a.sexpr() for a in atoms).encode())
+    return h.hexdigest()
+
+def vc_cache_get(key):
+    try:
+        with open(os.path.join(opt_vc_cache.get(),key)) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+def vc_cache_put(key,res):
+    dir = opt_vc_cache.get()
+    try:
+        os.makedirs(dir,exist_ok=True)
+        path = os.path.join(dir,key)
+        tmp = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp,'w') as f:
+            f.write(res)
+        os.replace(tmp,path)
+    except OSError:
+        pass
+
+def decide_cached(s,atoms=None,unknown_ok=False,query=None):
+    if not opt_vc_cache.get():
+        return decide(s,atoms,unknown_ok=unknown_ok)
+    key = vc_cache_key(*(query or (s.assertions(),atoms)))
+    if vc_cache_get(key) == 'unsat':
+        return z3.unsat
+    res = decide(s,atoms,unknown_ok=unknown_ok)
+    if res != z3.unknown:
+        vc_cache_put(key,'unsat' if res == z3.unsat else 'sat')
+    return res
+
+# Limits on the resources the solver may use for one check, in seconds
+# and megabytes (zero means no limit). A check that exceeds a limit
+# gives the result "unknown". It is then retried up to vc_retries times
+# with different random seeds. If the result is still unknown, decide
+# raises an error unless the caller accepts unknown results.
+
+def is_nat(s):
+    return str(s).isdigit()
+
+opt_vc_timeout = iu.Parameter("vc_timeout",0,check=is_nat,process=int)
+opt_vc_memory = iu.Parameter("vc_memory",0,check=is_nat,process=int)
+opt_vc_retries = iu.Parameter("vc_retries",0,check=is_nat,process=int)
+
+def set_vc_limits(s):
+    if opt_vc_timeout.get():
+        s.set('timeout',opt_vc_timeout.get() * 1000)
+    if opt_vc_memory.get():
+        s.set('max_memory',opt_vc_memory.get())
+
+# Z3 may raise an exception instead of returning unknown when a limit
+# is exceeded (for example, "max. memory exceeded"). This is treated
+# as an unknown result, with the message of the exception as the reason.
+
+check_error = None
+
+def solver_check(s,atoms=None):
+    global check_error
+    check_error = None
+    try:
+        return s.check() if atoms == None else s.check(atoms)
+    except z3.Z3Exception as e:
+        msg = e.value
+        check_error = msg.decode() if isinstance(msg,bytes) else str(msg)
+        return z3.unknown
+
+def reason_unknown(s):
+    """ The reason for the unknown result of the last check of s. """
+    return check_error if check_error is not None else s.reason_unknown()
+
+def decide(s,atoms=None,unknown_ok=False):
     # print ("solving{")
     # f = open("ivy.smt2","w")
     # f.write(s.to_smt2())
     # f.close()
-    res = s.check() if atoms == None else s.check(atoms)
-    if res == z3.unknown:
-        print(s.to_smt2())
-        raise iu.IvyError(None,"Solver produced inconclusive result")
+    set_vc_limits(s)
+    res = solver_check(s,atoms)
+    if res == z3.unknown and opt_vc_retries.get():
+        for seed in range(1,opt_vc_retries.get()+1):
+            s.set('random_seed',opt_seed.get() + seed)
+            res = solver_check(s,atoms)
+            if res != z3.unknown:
+                break
+        s.set('random_seed',opt_seed.get())
+    if res == z3.unknown and not unknown_ok:
+        if opt_show_vcs.get():
+            print(s.to_smt2())
+        raise iu.IvyError(None,"Solver produced inconclusive result ({})".format(reason_unknown(s)))
     # print ("}")
     return res
 
+# Strategies for minimizing the model of a satisfiable solver s, for
+# get_small_model. Each sort or relation x in turn is restricted to the
+# least size n such that size_constraint(x,n) is satisfiable, and the
+# constraint is kept for the following ones. On return, the last check
+# of s is satisfiable, so its model is the minimized one.
+#
+# The "linear" strategy tries n = 1,2,3,... using push/pop. The
+# "binary" strategy starts from the size of x in the current model if
+# there is one (else grows n exponentially) and then bisects. Each
+# trial size is guarded by a fresh assumption literal rather than
+# push/pop, so that the solver keeps the clauses it has learned.
+
+opt_shrink = iu.Parameter("shrink","linear",check=lambda s: s in ['linear','binary'])
+
+def shrink_linear(s,xs):
+    for x in xs:
+        for n in itertools.count(1):
+            s.push()
+            sc = size_constraint(x, n)
+            s.add(formula_to_z3(sc))
+            res = decide(s)
+            if res == z3.sat:
+                break
+            else:
+                s.pop()
+
+def model_size_bound(s,x):
+    if type(x) is lg.UninterpretedSort:
+        try:
+            univ = s.model().get_universe(x.to_z3())
+        except (z3.Z3Exception,AttributeError):
+            return None
+        if univ is not None:
+            return max(1,len(univ))
+    return None
+
+def shrink_binary(s,xs):
+    fixed = []    # assumption literals of the sizes found so far
+    last = [None] # (x,n) of the last trial, if it was satisfiable
+    def trial(x,n):
+        lit = z3.FreshBool('__size')
+        s.add(z3.Implies(lit,formula_to_z3(size_constraint(x, n))))
+        res = decide(s,fixed+[lit]) == z3.sat
+        last[0] = (x,n,lit) if res else None
+        return res
+    for x in xs:
+        lo,hi = 1,model_size_bound(s,x)
+        if hi is None:
+            n = 1
+            while not trial(x,n):
+                lo = n + 1
+                n *= 2
+            hi = n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if trial(x,mid):
+                hi = mid
+            else:
+                lo = mid + 1
+        if last[0] is None or last[0][:2] != (x,hi):
+            trial(x,hi)
+        fixed.append(last[0][2])
+
+# If vc_profiler is set, it is called by get_small_model for each final
+# condition that is checked, with the condition and a dictionary of
+# measurements: times in seconds to translate the background clauses
+# ("setup") and the condition ("build") to Z3, to solve ("solve"), the
+# result, and the Z3 statistics of the check. If a model is then
+# minimized, the time is added to the same dictionary as "minimize".
+
+vc_profiler = None
+
+def solver_statistics(s):
+    st = s.statistics()
+    return dict((k,st.get_key_value(k)) for k in st.keys())
+
+def check_final_cond(s,fc,setup_time,atoms=None,query=None):
+    """ Add the final condition fc to solver s and check it under the
+    assumptions atoms, calling the handlers of fc. Returns z3.sat if
+    the condition is satisfiable and the result should not be ignored,
+    else z3.unsat, and the profile data, if any. If query is given, it
+    is a pair of the formulas of s and the assumptions the check
+    depends on (for vc_cache). """
+    start = time.time()
+    foo = fc.cond()
+    sys.stdout.flush()
+    if opt_show_vcs.get():
+        print('\nassert: {}'.format(foo))
+        sys.stdout.flush()
+    the_fmla = clauses_to_z3(foo)
+    s.add(the_fmla)
+    built = time.time()
+    if query is not None:
+        query = (query[0] + [the_fmla],query[1])
+    res = decide_cached(s,atoms,unknown_ok=True,query=query)
+    prof = None
+    if vc_profiler is not None:
+        prof = {'setup':setup_time,'build':built - start,
+                'solve':time.time() - built,'result':str(res),
+                'stats':solver_statistics(s)}
+        vc_profiler(fc,prof)
+    if res == z3.unknown:
+        fc.unknown(reason_unknown(s))
+        res = z3.unsat
+    elif res != z3.unsat:
+        if fc.sat():
+            res = z3.unsat
+    else:
+        fc.unsat()
+    return res,prof
+
+# A session is a solver for checking many final conditions against
+# the same background. Sets of clauses are added once, each under an
+# activation literal, and a check assumes the literals of the clauses
+# it uses, plus any other assumptions. Each final condition is added
+# in a push/pop scope, so the solver keeps what it learns about the
+# background between checks.
+
+class Session(object):
+    def __init__(self,background):
+        start = time.time()
+        self.solver = z3.Solver()
+        self.background = clauses_to_z3(background)
+        self.solver.add(self.background)
+        self.setup_time = time.time() - start
+        self.lits = dict()
+        self.fmlas = dict()   # formula of each literal, by id
+
+    def add(self,fmla):
+        lit = z3.FreshBool('__session')
+        self.solver.add(z3.Implies(lit,fmla))
+        self.fmlas[get_id(lit)] = fmla
+        return lit
+
+    def activate(self,key,clauses):
+        """ Add clauses under a literal, once for each key. Returns the literal. """
+        if key not in self.lits:
+            start = time.time()
+            self.lits[key] = self.add(clauses_to_z3(clauses))
+            self.setup_time += time.time() - start
+        return self.lits[key]
+
+    def query(self,atoms):
+        """ The formulas and assumptions a check under atoms depends on,
+        for vc_cache. The literals of the session are replaced by their
+        formulas, and the Boolean constants assumed by their values, so
+        the key does not depend on the names of these. """
+        fmlas = [self.background] + [self.fmlas[get_id(a)] for a in atoms
+                                     if get_id(a) in self.fmlas]
+        subst,others = [],[]
+        for a in atoms:
+            if get_id(a) in self.fmlas:
+                continue
+            if z3.is_not(a) and z3.is_const(a.arg(0)):
+                subst.append((a.arg(0),z3.BoolVal(False)))
+            elif z3.is_const(a) and z3.is_bool(a):
+                subst.append((a,z3.BoolVal(True)))
+            else:
+                others.append(a)
+        if subst:
+            fmlas = [z3.substitute(f,*subst) for f in fmlas]
+        return fmlas,others
+
+    def check(self,final_cond,atoms):
+        """ Check a list of final conditions, as in get_small_model,
+        assuming the formulas atoms. Returns true if none failed. """
+        s = self.solver
+        atoms = list(atoms)
+        for fc in final_cond:
+            fc.start()
+            if fc.assume():
+                atoms.append(self.add(clauses_to_z3(fc.cond())))
+            else:
+                s.push()
+                res,prof = check_final_cond(s,fc,self.setup_time,atoms,self.query(atoms))
+                s.pop()
+                if res == z3.sat:
+                    return False
+        return True
+
 def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_cond=None, shrink=True):
     """
     Return a HerbrandModel with a "small" model of clauses.
@@ -1191,6 +1558,7 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
         start(): called before starting
         sat(): called if sat, return True if should ignore result
         unsat() : called if unsat
+        unknown(reason) : called if the solver gives up
         assume() : if returns true, assume rather than check
 
     """
@@ -1206,16 +1574,19 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
             print(fmla)
             print()
 
+    start = time.time()
     s = z3.Solver()
     the_fmla = clauses_to_z3(clauses)
 #    iu.dbg('the_fmla')
     s.add(the_fmla)
+    setup_time = time.time() - start
     
     # res = decide(s)
     # if res == z3.unsat:
     #     return None
 
     assumes = []
+    prof = None
     if final_cond is not None:
         if isinstance(final_cond,list):
             res = z3.unsat
@@ -1236,23 +1607,9 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
                     sys.stdout.flush()
                     if opt_incremental.get():
                         s.push()
-                    sys.stdout.flush()
-                    foo = fc.cond()
-                    sys.stdout.flush()
-                    if opt_show_vcs.get():
-                        print('\nassert: {}'.format(foo))
-                        sys.stdout.flush()
-                    the_fmla = clauses_to_z3(foo)
-                    # iu.dbg('the_fmla')
-                    s.add(the_fmla)
-                    res = decide(s)
-                    if res != z3.unsat:
-                        if fc.sat():
-                            res = z3.unsat
-                        else:
-                            break
-                    else:
-                        fc.unsat()
+                    res,prof = check_final_cond(s,fc,setup_time)
+                    if res == z3.sat:
+                        break
                     if opt_incremental.get():
                         s.pop()
         else:
@@ -1266,17 +1623,14 @@ def get_small_model(clauses, sorts_to_minimize, relations_to_minimize, final_con
     if shrink:
         print("searching for a small model...", end=' ')
         sys.stdout.flush()
-        for x in chain(sorts_to_minimize, relations_to_minimize):
-            for n in itertools.count(1):
-                s.push()
-                sc = size_constraint(x, n)
-                s.add(formula_to_z3(sc))
-                res = decide(s)
-                if res == z3.sat:
-                    break
-                else:
-                    s.pop()
-        print("done")
+        start = time.time()
+        if opt_shrink.get() == 'binary':
+            shrink_binary(s, chain(sorts_to_minimize, relations_to_minimize))
+        else:
+            shrink_linear(s, chain(sorts_to_minimize, relations_to_minimize))
+        print("done ({:.2f}s)".format(time.time() - start))
+        if prof is not None:
+            prof['minimize'] = time.time() - start
     m = get_model(s)
     # print ("model = {}".format(m))
     # f = open("ivy.smt2","w")
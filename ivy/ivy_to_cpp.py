@@ -27,6 +27,7 @@ import platform
 from collections import defaultdict
 from operator import mul
 import re
+import hashlib
 from functools import reduce
 
 
@@ -1189,6 +1190,83 @@ def get_lib_dirs(with_z3=True):
     return dirs
 
 
+# An action whose precondition is a simple constraint can be generated
+# without calling the solver. The inputs are sampled at random from
+# their ranges, as randomize does, and the precondition is evaluated in
+# C++. If no sample satisfies it in a few tries, we fall back to the
+# solver. The inputs must be scalar parameters of the action with a
+# finite or integer sort, and the precondition must be quantifier-free,
+# built from equalities, comparisons, if-then-else and Boolean
+# connectives over the inputs, numerals, enumerated values and state
+# components.
+
+fast_gen_ops = set(['<','<=','>','>='])
+fast_gen_tries = 8
+
+def is_fast_gen_sort(sort):
+    if sort_domain(sort) or sort in sort_to_cpptype:
+        return False
+    if sort.name in im.module.sort_destructors or sort.name in im.module.native_types:
+        return False
+    if sort.name == 'bool' or il.is_enumerated_sort(sort) and sort.name not in il.sig.interp:
+        return True
+    itp = il.sig.interp.get(sort.name,None)
+    return itp in ['int','nat'] or isinstance(itp,il.RangeSort) or isinstance(itp,str) and itp.startswith('bv[')
+
+def is_fast_gen_fmla(fmla,inputs,ssyms):
+    if il.is_app(fmla):
+        sym = fmla.rep
+        if not (sym in inputs or sym.is_numeral() or sym in il.sig.constructors
+                or sym in ssyms and sym not in is_derived
+                or slv.solver_name(sym) == None and sym.name in fast_gen_ops):
+            return False
+    elif not isinstance(fmla,(lg.And,lg.Or,lg.Not,lg.Implies,lg.Iff,lg.Eq,lg.Ite)):
+        return False
+    return all(is_fast_gen_fmla(x,inputs,ssyms) for x in fmla.args)
+
+def fast_gen_inputs(action,pre,syms,defed_params,fsyms,defidx,ssyms):
+    """ Returns the inputs to sample if the action can be generated
+    without the solver, else None. """
+    if not opt_fast_gen.get():
+        return None
+    params = set(p.prefix('__') for p in action.formal_params)
+    res = []
+    for sym in syms:
+        if sym.name.startswith('__ts') or sym in defidx or sym.name == '*>' or fsyms.get(sym,sym) != sym:
+            return None
+        if sym not in defed_params:
+            if sym not in params or not is_fast_gen_sort(sym.sort):
+                return None
+            res.append(sym)
+    return res if is_fast_gen_fmla(pre,set(res),ssyms) else None
+
+def emit_fast_gen(impl,inputs,pre,orig_pre,param_defs,classname,ssyms,fsyms):
+    """ Emit the sampling of the inputs. Returns true if the
+    precondition is trivial, so the solver is not needed. """
+    global delegate_enums_to
+    trivial = il.is_true(pre)
+    if not trivial:
+        for sym in ilu.used_symbols_ast(pre):
+            if sym in ssyms:
+                code_line(impl,sym_decl(sym,classname=classname,isref=True,ival='obj.'+code_eval(impl,sym)))
+        open_scope(impl,line='for (int __attempt = 0; __attempt < {}; __attempt++) '.format(fast_gen_tries))
+    for sym in inputs:
+        sname = sym.sort.name
+        code_line(impl,'{} = ({})random_range(sort_range(sort("{}"),"{}"))'.format(varname(sym),ctype(sym.sort,classname=classname),sname,sname))
+    if not trivial:
+        delegate_enums_to = classname
+        cond = code_eval(impl,pre)
+        delegate_enums_to = ''
+        open_scope(impl,line='if ({}) '.format(cond))
+    emit_defined_inputs(orig_pre,param_defs,impl,classname,ssyms,fsyms)
+    code_line(impl,'fast_count++')
+    code_line(impl,'obj.___ivy_gen = this')
+    code_line(impl,'return true')
+    if not trivial:
+        close_scope(impl)
+        close_scope(impl)
+    return trivial
+
 def emit_action_gen(header,impl,name,action,classname):
     global indent_level
     global global_classname
@@ -1218,7 +1296,7 @@ def emit_action_gen(header,impl,name,action,classname):
     orig_pre = pre
     pre_clauses = ilu.trim_clauses(pre)
     pre_clauses = expand_field_references(pre_clauses)
-    inputs = [x for x in ilu.used_symbols_clauses(pre_clauses) if is_local_sym(x) and not x.is_numeral()]
+    inputs = sorted((x for x in ilu.used_symbols_clauses(pre_clauses) if is_local_sym(x) and not x.is_numeral()),key=str)
     inputset = set(inputs)
     for p in action.formal_params:
         p = p.prefix('__')
@@ -1257,7 +1335,7 @@ def emit_action_gen(header,impl,name,action,classname):
     emit_sig(impl)
     to_decl = set(syms)
     to_decl.update(s for s in used if s.name == '*>')
-    for sym in to_decl:
+    for sym in sorted(to_decl,key=str):
         emit_decl(impl,sym)
     indent(impl)
     import platform
@@ -1273,53 +1351,61 @@ def emit_action_gen(header,impl,name,action,classname):
 #    impl.append('__ivy_modelfile << slvr << std::endl;\n')
     indent_level -= 1
     impl.append("}\n");
-    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n    push();\n")
+    impl.append("bool " + caname + "_gen::generate(" + classname + "& obj) {\n")
     indent_level += 1
-    for cpptype in cpptypes:
-        code_line(impl,cpptype.short_name()+'::prepare()')
-    pre_used = ilu.used_symbols_ast(pre)
-    for psym in im.module.params:
-        if not psym.sort.dom:
-            itp = il.sig.interp.get(psym.sort.name,None)
-            if isinstance(itp,il.RangeSort) and psym in [itp.lb,itp.ub]:
-                pre_used.add(psym)
-    for sym in all_state_symbols():
-        if sym in pre_used and sym not in old_pre_clauses.defidx: # skip symbols not used in constraint
-            if slv.solver_name(il.normalize_symbol(sym)) != None: # skip interpreted symbols
-                if sym_is_member(sym):
-                    emit_set(impl,sym)
-    code_line(impl,'alits.clear()')
-    for sym in syms:
-        if not sym.name.startswith('__ts') and sym not in old_pre_clauses.defidx  and sym.name != '*>':
-            emit_randomize(impl,sym,classname=classname)
-#    impl.append('    std::cout << "generating {}" << std::endl;\n'.format(caname))
-    impl.append("""
-    // std::cout << slvr << std::endl;
-    bool __res = solve();
-    if (__res) {
-""")
-    indent_level += 1
-    for sym in syms:
-        if not sym.name.startswith('__ts') and sym not in old_pre_clauses.defidx and sym.name != '*>':
-            if sym not in defed_params:
-                emit_eval(impl,sym,classname=classname,lhs=fsyms.get(sym,sym))
     ssyms = set()
     for sym in all_state_symbols():
 #        if sym_is_member(sym):
         if sym.name not in im.module.destructor_sorts:
             ssyms.add(sym)
-    emit_defined_inputs(orig_pre,param_defs,impl,classname,ssyms,fsyms)
-    indent_level -= 2
-    impl.append("""
+    fast_inputs = fast_gen_inputs(action,pre,syms,defed_params,fsyms,old_pre_clauses.defidx,ssyms)
+    trivial = False
+    if fast_inputs is not None and not rdefs and not pre_clauses.defs:
+        trivial = emit_fast_gen(impl,fast_inputs,pre,orig_pre,param_defs,classname,ssyms,fsyms)
+    if not trivial:
+        code_line(impl,'solver_count++')
+        code_line(impl,'push()')
+        for cpptype in cpptypes:
+            code_line(impl,cpptype.short_name()+'::prepare()')
+        pre_used = ilu.used_symbols_ast(pre)
+        for psym in im.module.params:
+            if not psym.sort.dom:
+                itp = il.sig.interp.get(psym.sort.name,None)
+                if isinstance(itp,il.RangeSort) and psym in [itp.lb,itp.ub]:
+                    pre_used.add(psym)
+        for sym in all_state_symbols():
+            if sym in pre_used and sym not in old_pre_clauses.defidx: # skip symbols not used in constraint
+                if slv.solver_name(il.normalize_symbol(sym)) != None: # skip interpreted symbols
+                    if sym_is_member(sym):
+                        emit_set(impl,sym)
+        code_line(impl,'alits.clear()')
+        for sym in syms:
+            if not sym.name.startswith('__ts') and sym not in old_pre_clauses.defidx  and sym.name != '*>':
+                emit_randomize(impl,sym,classname=classname)
+#        impl.append('    std::cout << "generating {}" << std::endl;\n'.format(caname))
+        impl.append("""
+    // std::cout << slvr << std::endl;
+    bool __res = solve();
+    if (__res) {
+""")
+        indent_level += 1
+        for sym in syms:
+            if not sym.name.startswith('__ts') and sym not in old_pre_clauses.defidx and sym.name != '*>':
+                if sym not in defed_params:
+                    emit_eval(impl,sym,classname=classname,lhs=fsyms.get(sym,sym))
+        emit_defined_inputs(orig_pre,param_defs,impl,classname,ssyms,fsyms)
+        indent_level -= 1
+        impl.append("""
     }""")
-    for cpptype in cpptypes:
-        code_line(impl,cpptype.short_name()+'::cleanup()')
-    impl.append("""
+        for cpptype in cpptypes:
+            code_line(impl,cpptype.short_name()+'::cleanup()')
+        impl.append("""
     pop();
     obj.___ivy_gen = this;
     return __res;
-}
 """)
+    indent_level -= 1
+    impl.append("}\n")
     open_scope(impl,line="void " + caname + "_gen::execute(" + classname + "& obj)")
     if action.formal_params:
         code_line(impl,'__ivy_out << "> {}("'.format(name.split(':')[-1]) + ' << "," '.join(' << {}'.format(varname(p)) for p in action.formal_params) + ' << ")" << std::endl')
@@ -2043,7 +2129,11 @@ def module_to_cpp_class(classname,basename):
 #include <netinet/in.h>
 #include <netinet/ip.h> 
 #include <sys/select.h>
+#include <sys/wait.h>
 #include <unistd.h>
+#include <sys/mman.h>
+#include <poll.h>
+#include <errno.h>
 #define _open open
 #define _dup2 dup2
 #endif
@@ -2125,7 +2215,10 @@ void * _thread_timer( void *tmr_void )
 #endif 
 """)
 
-    if target.get() == "repl":
+    if target.get() == "repl" and opt_event_loop.get():
+        emit_event_loop(impl,classname)
+
+    if target.get() == "repl" and not opt_event_loop.get():
         impl.append("""
 void CLASSNAME::install_reader(reader *r) {
     #ifdef _WIN32
@@ -3271,9 +3364,14 @@ z3::expr __z3_rename(const z3::expr &e, hash_map<std::string,std::string> &rn) {
                 emit_repl_boilerplate2(header,impl,classname)
 
 
+                if target.get() == "test":
+                    emit_test_workers(impl)
+                if target.get() == "repl" and opt_event_loop.get():
+                    emit_event_loop_main(impl)
                 impl.append("int "+ opt_main.get() + "(int argc, char **argv){\n")
                 impl.append("        int test_iters = TEST_ITERS;\n".replace('TEST_ITERS',opt_test_iters.get()))
                 impl.append("        int runs = TEST_RUNS;\n".replace('TEST_RUNS',opt_test_runs.get()))
+                impl.append("        int workers = TEST_WORKERS;\n".replace('TEST_WORKERS',opt_test_workers.get()))
                 for p,d in zip(im.module.params,im.module.param_defaults):
 #                    impl.append('    {} p__'.format(ctypefull(p.sort,classname=classname))+varname(p)+';\n')
                     impl.append('    {};\n'.format(sym_decl(p.prefix('p__'),classname=classname)))
@@ -3283,6 +3381,7 @@ z3::expr __z3_rename(const z3::expr &e, hash_map<std::string,std::string> &rn) {
                         emit_value_parser(impl,p,'"{}"'.format(d.rep.replace('"','\\"')),classname,lineno=d.lineno)
                 impl.append("""
     int seed = 1;
+    int gen_stats = 0;
     int sleep_ms = 10;
     int final_ms = 0; 
     
@@ -3324,6 +3423,12 @@ z3::expr __z3_rename(const z3::expr &e, hash_map<std::string,std::string> &rn) {
             else if (param == "seed") {
                 seed = atoi(value.c_str());
             }
+            else if (param == "workers") {
+                workers = atoi(value.c_str());
+            }
+            else if (param == "gen_stats") {
+                gen_stats = atoi(value.c_str());
+            }
             else if (param == "delay") {
                 sleep_ms = atoi(value.c_str());
             }
@@ -3343,6 +3448,21 @@ z3::expr __z3_rename(const z3::expr &e, hash_map<std::string,std::string> &rn) {
             }
         }
     }
+""")
+                if target.get() == "test":
+                    impl.append("""
+    if (workers > 1) {
+#ifdef _WIN32
+        std::cerr << "workers are not supported on Windows" << std::endl;
+        return 1;
+#else
+        int status;
+        if (__ivy_fork_workers(workers,seed,test_iters,status) < 0)
+            return status;
+#endif
+    }
+""")
+                impl.append("""
     srand(seed);
     if (!__ivy_out.is_open())
         __ivy_out.basic_ios<char>::rdbuf(std::cout.rdbuf());
@@ -4281,7 +4401,7 @@ def emit_assign(self,header):
 #            
 #            emit_assign_large(self,header)
 #            return
-        vs = list(lu.free_variables(self.args[0]))
+        vs = sorted(lu.free_variables(self.args[0]),key=str)
 #        for v in vs:
 #            check_iterable_sort(v.sort)
         if len(vs) == 0:
@@ -4985,6 +5105,20 @@ def emit_winsock_init(impl):
 
 
 def emit_repl_boilerplate3(header,impl,classname):
+    if opt_event_loop.get():
+        impl.append("""
+
+    ivy.__unlock();
+
+    cmd_reader *cr = new cmd_reader(ivy);
+
+    // The main thread runs the console reader and the event loop
+
+    __ivy_event_loop(cr);
+    return 0;
+
+""")
+        return
     impl.append("""
 
     ivy.__unlock();
@@ -5005,6 +5139,7 @@ def emit_repl_boilerplate3server(header,impl,classname):
     
     ivy.__unlock();
 
+    EVENT_LOOP
     // The main thread waits for all reader threads to die
 
     for(unsigned i = 0; true ; i++) {
@@ -5019,7 +5154,7 @@ def emit_repl_boilerplate3server(header,impl,classname):
     }
     return 0;
 
-""".replace('classname',classname))
+""".replace('classname',classname).replace('EVENT_LOOP','__ivy_event_loop(0);\n' if opt_event_loop.get() else ''))
 
 def emit_repl_boilerplate3test(header,impl,classname):
     impl.append("""
@@ -5032,6 +5167,7 @@ def emit_repl_boilerplate3test(header,impl,classname):
         init_gen my_init_gen(ivy);
         my_init_gen.generate(ivy);
         std::vector<gen *> generators;
+        std::vector<const char *> gen_names;
         std::vector<double> weights;
 
 """)
@@ -5043,6 +5179,7 @@ def emit_repl_boilerplate3test(header,impl,classname):
         num_public_actions += 1
         action = im.module.actions[actname]
         impl.append("        generators.push_back(new {}_gen(ivy));\n".format(varname(actname)))
+        impl.append('        gen_names.push_back("{}");\n'.format(actname[4:] if actname.startswith('ext:') else actname))
         aname = (actname[4:] if actname.startswith('ext:') else actname) +'.weight'
         if aname in im.module.attributes:
             astring = im.module.attributes[aname].rep
@@ -5058,6 +5195,9 @@ def emit_repl_boilerplate3test(header,impl,classname):
         totalweight += aval
     impl.append("        double totalweight = {};\n".format(totalweight))
     impl.append("        int num_gens = {};\n".format(num_public_actions))
+    impl.append("        __ivy_gen_names = gen_names;\n")
+    impl.append("        __ivy_gen_execs.resize(num_gens);\n")
+    impl.append("        __ivy_gen_fails.resize(num_gens);\n")
             
     final_code = 'ivy.__lock(); ivy.ext___finalize(); ivy.__unlock();' if 'ext:_finalize' in im.module.public_actions else ''
     
@@ -5071,6 +5211,11 @@ def emit_repl_boilerplate3test(header,impl,classname):
     bool do_over = false;
     for(int cycle = 0; cycle < test_iters; cycle++) {
 
+#ifndef _WIN32
+        if (__ivy_stop && *__ivy_stop)
+            __ivy_exit(0);
+#endif
+
 //        std::cout << "totalweight = " << totalweight << std::endl;
 //        double choices = totalweight + readers.size() + timers.size();
         double choices = totalweight + 5.0;
@@ -5103,6 +5248,7 @@ def emit_repl_boilerplate3test(header,impl,classname):
 //            __ivy_out << "idx: " << idx << " sat: " << sat << " time: " << (((double)(after.QuadPart-before.QuadPart))/freq.QuadPart) << std::endl;
 #endif
             if (sat){
+                __ivy_gen_execs[idx]++;
                 g.execute(ivy);
                 ivy._generating = false;
                 ivy.__unlock();
@@ -5111,6 +5257,7 @@ def emit_repl_boilerplate3test(header,impl,classname):
 #endif
             }
             else {
+                __ivy_gen_fails[idx]++;
                 ivy._generating = false;
                 ivy.__unlock();
                 cycle--;
@@ -5206,6 +5353,11 @@ def emit_repl_boilerplate3test(header,impl,classname):
 #ifdef _WIN32
                 Sleep(final_ms);  // HACK: wait for late responses
 #endif
+    if (gen_stats) {
+        for (unsigned i = 0; i < generators.size(); i++)
+            std::cerr << "generated " << gen_names[i] << ": " << generators[i]->fast_count
+                      << " fast, " << generators[i]->solver_count << " by solver" << std::endl;
+    }
     __ivy_out << "test_completed" << std::endl;
     if (runidx == runs-1) {
         struct timespec ts;
@@ -5225,6 +5377,289 @@ def emit_repl_boilerplate3test(header,impl,classname):
 
 """.replace('classname',classname).replace('FINALIZE',final_code))
 
+# With event_loop, a repl runs its readers and timers in the main
+# thread instead of starting a thread for each of them. The loop
+# waits with poll for a reader to become readable or for the next
+# timer deadline, and then calls the reader or timer, which takes the
+# lock as usual. Readers are bound by the loop, since bind may take
+# the lock, which is held when readers are installed. Threads
+# installed with install_thread are still started as threads.
+
+def emit_event_loop(impl,classname):
+    impl.append("""
+#ifdef _WIN32
+#error "event_loop is not supported on Windows"
+#endif
+
+struct __ivy_timer_slot {
+    timer *tmr;
+    long long last;      // time of the last timeout in ms
+    long long deadline;  // time of the next timeout in ms
+};
+
+std::vector<reader *> __ivy_readers;
+std::vector<reader *> __ivy_unbound;
+std::vector<__ivy_timer_slot> __ivy_timers;
+
+long long __ivy_now_ms() {
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC,&ts);
+    return (long long)ts.tv_sec * 1000 + ts.tv_nsec / 1000000;
+}
+
+void CLASSNAME::install_reader(reader *r) {
+    __ivy_unbound.push_back(r);
+}
+
+void CLASSNAME::install_thread(reader *r) {
+    pthread_t thread;
+    int res = pthread_create(&thread, NULL, _thread_reader, r);
+    if (res) {
+        std::cerr << "failed to create thread" << std::endl;
+        exit(1);
+    }
+    thread_ids.push_back(thread);
+}
+
+void CLASSNAME::install_timer(timer *t) {
+    __ivy_timer_slot slot;
+    slot.tmr = t;
+    slot.last = __ivy_now_ms();
+    slot.deadline = slot.last + t->ms_delay();
+    __ivy_timers.push_back(slot);
+}
+""".replace('CLASSNAME',classname))
+
+def emit_event_loop_main(impl):
+    impl.append("""
+// Runs the readers and timers until the console reader cr reaches end
+// of file or, if there is none, until no readers or timers remain.
+
+void __ivy_event_loop(stdin_reader *cr) {
+    std::vector<struct pollfd> fds;
+    std::vector<reader *> rdrs;
+    while (true) {
+        while (__ivy_unbound.size()) {
+            reader *r = __ivy_unbound.back();
+            __ivy_unbound.pop_back();
+            r->bind();
+            __ivy_readers.push_back(r);
+        }
+        for (unsigned i = 0; i < __ivy_readers.size(); i++) {
+            if (!__ivy_readers[i]->running()) {
+                delete __ivy_readers[i];
+                __ivy_readers.erase(__ivy_readers.begin()+i);
+                i--;
+            }
+        }
+        if (cr ? cr->eof() : __ivy_readers.empty() && __ivy_timers.empty())
+            break;
+        fds.clear();
+        rdrs.clear();
+        if (cr)
+            rdrs.push_back(cr);
+        rdrs.insert(rdrs.end(),__ivy_readers.begin(),__ivy_readers.end());
+        for (unsigned i = 0; i < rdrs.size(); i++) {
+            struct pollfd pfd;
+            pfd.fd = rdrs[i]->fdes();
+            pfd.events = POLLIN;
+            pfd.revents = 0;
+            fds.push_back(pfd);
+        }
+        long long now = __ivy_now_ms();
+        int wait = -1;
+        for (unsigned i = 0; i < __ivy_timers.size(); i++) {
+            long long ms = __ivy_timers[i].deadline - now;
+            if (ms < 0)
+                ms = 0;
+            if (wait < 0 || ms < wait)
+                wait = ms;
+        }
+        if (poll(fds.size() ? &fds[0] : 0,fds.size(),wait) < 0) {
+            if (errno == EINTR)
+                continue;
+            perror("poll failed");
+            __ivy_exit(1);
+        }
+        for (unsigned i = 0; i < fds.size(); i++)
+            if (fds[i].revents && (rdrs[i] == cr || rdrs[i]->running()))
+                rdrs[i]->read();
+        now = __ivy_now_ms();
+        for (unsigned i = 0; i < __ivy_timers.size(); i++) {
+            if (now >= __ivy_timers[i].deadline) {
+                timer *t = __ivy_timers[i].tmr;
+                int elapsed = now - __ivy_timers[i].last;
+                __ivy_timers[i].last = now;
+                t->timeout(elapsed);
+                __ivy_timers[i].deadline = now + t->ms_delay();
+            }
+        }
+    }
+}
+""")
+
+# With workers=N, the tester forks N worker processes. Worker w
+# uses seed+w and gets an equal share of the iterations of each run.
+# A worker writes its trace to a temporary file and sends its
+# per-action statistics to the parent over a pipe when it exits.
+# As soon as one worker fails, the parent raises a shared stop flag
+# that the other workers check on each test cycle. It then copies
+# the trace of the failing worker to the output and prints the seed
+# that reproduces it.
+
+def emit_test_workers(impl):
+    impl.append("""
+std::vector<const char *> __ivy_gen_names;
+std::vector<long> __ivy_gen_execs, __ivy_gen_fails;
+
+#ifndef _WIN32
+int __ivy_stats_fd = -1;
+volatile int *__ivy_stop = 0;
+
+void __ivy_send_stats() {
+    std::ostringstream stats;
+    for (unsigned i = 0; i < __ivy_gen_names.size(); i++)
+        stats << __ivy_gen_names[i] << " " << __ivy_gen_execs[i] << " " << __ivy_gen_fails[i] << std::endl;
+    std::string str = stats.str();
+    if (write(__ivy_stats_fd,str.c_str(),str.size()) < 0)
+        perror("cannot write statistics");
+    close(__ivy_stats_fd);
+}
+
+struct __ivy_worker {
+    pid_t pid;
+    int fd;
+    int seed;
+    int iters;
+    std::string trace;
+    std::string stats;
+};
+
+// Returns the worker index in a worker process. Returns -1 in the
+// parent when all workers are done, setting status to the exit code.
+
+int __ivy_fork_workers(int workers, int &seed, int &test_iters, int &status) {
+    std::vector<__ivy_worker> ws(workers);
+    __ivy_stop = (volatile int *) mmap(0,sizeof(int),PROT_READ|PROT_WRITE,MAP_SHARED|MAP_ANONYMOUS,-1,0);
+    if (__ivy_stop == MAP_FAILED)
+        {perror("mmap failed"); __ivy_exit(1);}
+    *__ivy_stop = 0;
+    for (int w = 0; w < workers; w++) {
+        __ivy_worker &wk = ws[w];
+        wk.seed = seed + w;
+        wk.iters = test_iters / workers + (w < test_iters % workers ? 1 : 0);
+        char tmpl[] = "/tmp/ivy_traceXXXXXX";
+        int tfd = mkstemp(tmpl);
+        if (tfd < 0)
+            {perror("cannot create trace file"); __ivy_exit(1);}
+        close(tfd);
+        wk.trace = tmpl;
+        int fds[2];
+        if (pipe(fds) < 0)
+            {perror("pipe failed"); __ivy_exit(1);}
+        std::cout.flush();
+        std::cerr.flush();
+        __ivy_out.flush();
+        wk.pid = fork();
+        if (wk.pid < 0)
+            {perror("fork failed"); __ivy_exit(1);}
+        if (wk.pid == 0) {
+            close(fds[0]);
+            for (int v = 0; v < w; v++)
+                close(ws[v].fd);
+            __ivy_stats_fd = fds[1];
+            atexit(__ivy_send_stats);
+            if (__ivy_out.is_open())
+                __ivy_out.close();
+            __ivy_out.open(wk.trace.c_str());
+            seed = wk.seed;
+            test_iters = wk.iters;
+            return w;
+        }
+        close(fds[1]);
+        wk.fd = fds[0];
+    }
+    int failed = -1;
+    int running = workers;
+    std::vector<struct pollfd> pfds(workers);
+    while (running > 0) {
+        for (int w = 0; w < workers; w++) {
+            pfds[w].fd = ws[w].fd;
+            pfds[w].events = POLLIN;
+            pfds[w].revents = 0;
+        }
+        if (poll(&pfds[0],workers,-1) < 0) {
+            if (errno == EINTR)
+                continue;
+            perror("poll failed");
+            __ivy_exit(1);
+        }
+        for (int w = 0; w < workers; w++) {
+            if (ws[w].fd < 0 || !pfds[w].revents)
+                continue;
+            char buf[4096];
+            int n = read(ws[w].fd,buf,sizeof(buf));
+            if (n > 0) {
+                ws[w].stats.append(buf,n);
+                continue;
+            }
+            close(ws[w].fd);
+            ws[w].fd = -1;
+            running--;
+            int wstatus;
+            waitpid(ws[w].pid,&wstatus,0);
+            if (!(WIFEXITED(wstatus) && WEXITSTATUS(wstatus) == 0) && failed < 0) {
+                failed = w;
+                *__ivy_stop = 1;
+            }
+        }
+    }
+
+    // merge the statistics lines "name executed failures" of the workers
+
+    std::vector<std::string> names;
+    std::vector<long> execs, fails;
+    long total = 0;
+    for (int w = 0; w < workers; w++) {
+        std::istringstream s(ws[w].stats);
+        std::string name;
+        long e, f;
+        while (s >> name >> e >> f) {
+            unsigned i = std::find(names.begin(),names.end(),name) - names.begin();
+            if (i == names.size()) {
+                names.push_back(name);
+                execs.push_back(0);
+                fails.push_back(0);
+            }
+            execs[i] += e;
+            fails[i] += f;
+            total += e;
+        }
+    }
+    for (unsigned i = 0; i < names.size(); i++)
+        std::cerr << "executed " << names[i].c_str() << ": " << execs[i] << " times, "
+                  << fails[i] << " generation failures" << std::endl;
+    std::cerr << "executed " << total << " actions in " << workers << " workers" << std::endl;
+
+    if (!__ivy_out.is_open())
+        __ivy_out.basic_ios<char>::rdbuf(std::cout.rdbuf());
+    if (failed >= 0) {
+        std::cerr << "worker " << failed << " failed, reproduce with seed=" << ws[failed].seed
+                  << " iters=" << ws[failed].iters << std::endl;
+        std::ifstream trace(ws[failed].trace.c_str());
+        __ivy_out << trace.rdbuf();
+        __ivy_out.flush();
+    }
+    else
+        __ivy_out << "test_completed" << std::endl;
+    for (int w = 0; w < workers; w++)
+        unlink(ws[w].trace.c_str());
+    status = failed >= 0 ? 1 : 0;
+    return -1;
+}
+#endif
+""")
+
 def emit_boilerplate1(header,impl,classname):
     header.append("""
 #include <string>
@@ -5262,11 +5697,16 @@ public:
     std::vector<Z3_symbol> decl_names;
     std::vector<Z3_func_decl> decls;
     std::vector<z3::expr> alits;
+    std::vector<z3::expr> alit_pool;
     int tmp_ctr;
+    std::vector<int> tmp_ctrs;
+    unsigned long long fast_count;   // inputs sampled without the solver
+    unsigned long long solver_count; // calls to the solver
 
     gen(): slvr(ctx), model(ctx,(Z3_model)0) {
         enum_sorts.insert(std::pair<std::string, z3::sort>("bool",ctx.bool_sort()));
         tmp_ctr = 0;
+        fast_count = solver_count = 0;
     }
 
 
@@ -5526,9 +5966,14 @@ public:
     void add_alit(const z3::expr &pred){
         if (__ivy_modelfile.is_open()) 
             __ivy_modelfile << "pred: " << pred << std::endl;
-        std::ostringstream ss;
-        ss << "alit:" << alits.size();
-        z3::expr alit = ctx.bool_const(ss.str().c_str());
+        // The assumption literals are allocated once and reused by
+        // each call to generate, so the context does not grow.
+        while (alit_pool.size() <= alits.size()) {
+            std::ostringstream ss;
+            ss << "alit:" << alit_pool.size();
+            alit_pool.push_back(ctx.bool_const(ss.str().c_str()));
+        }
+        z3::expr alit = alit_pool[alits.size()];
         if (__ivy_modelfile.is_open()) 
             __ivy_modelfile << "alit: " << alit << std::endl;
         alits.push_back(alit);
@@ -5581,12 +6026,18 @@ public:
         randomize(decl_name,3,args,sort_name);
     }
 
+    // Temporary constants created in a scope are not referenced after
+    // it is popped, so their names are reused.
+
     void push(){
         slvr.push();
+        tmp_ctrs.push_back(tmp_ctr);
     }
 
     void pop(){
         slvr.pop();
+        tmp_ctr = tmp_ctrs.back();
+        tmp_ctrs.pop_back();
     }
 
     z3::sort sort(const char *name) {
@@ -5731,10 +6182,18 @@ opt_build = iu.BooleanParameter("build",False)
 opt_trace = iu.BooleanParameter("trace",False)
 opt_test_iters = iu.Parameter("test_iters","100")
 opt_test_runs = iu.Parameter("test_runs","1")
+opt_test_workers = iu.Parameter("test_workers","1")
 opt_compiler = iu.EnumeratedParameter("compiler",["g++","cl","default"],"default")
 opt_main = iu.Parameter("main","main")
 opt_stdafx = iu.BooleanParameter("stdafx",False)
 opt_outdir = iu.Parameter("outdir","")
+opt_fast_gen = iu.BooleanParameter("fast_gen",True)
+opt_event_loop = iu.BooleanParameter("event_loop",False)
+opt_build_profile = iu.EnumeratedParameter("build_profile",["debug","release","lto"],"debug")
+opt_build_cache = iu.BooleanParameter("build_cache",True)
+
+gpp_profile_flags = {'debug':'-g','release':'-O2','lto':'-O2 -flto'}
+cl_profile_flags = {'debug':'/Zi','release':'/O2','lto':'/O2 /GL'}
 
 emit_main = True
 
@@ -5946,12 +6405,12 @@ def main_int(is_ivyc):
                             libpspec += ''.join(' /LIBPATH:{} '.format(d) for d in _libdir)
                         vsdir = find_vs()
                         if opt_compiler.get() != 'g++':
-                            cmd = '"{}\\VC\\vcvarsall.bat" amd64& cl /EHsc /Zi {}.cpp ws2_32.lib'.format(vsdir,basename)
+                            cmd = '"{}\\VC\\vcvarsall.bat" amd64& cl /EHsc {} {}.cpp ws2_32.lib'.format(vsdir,cl_profile_flags[opt_build_profile.get()],basename)
                             if target.get() in ['gen','test']:
-                                cmd = '"{}\\VC\\vcvarsall.bat" amd64& cl /MDd /EHsc /Zi {} {}.cpp ws2_32.lib libz3.lib /link {}'.format(vsdir,incspec,basename,libpspec)
+                                cmd = '"{}\\VC\\vcvarsall.bat" amd64& cl /MDd /EHsc {} {} {}.cpp ws2_32.lib libz3.lib /link {}'.format(vsdir,cl_profile_flags[opt_build_profile.get()],incspec,basename,libpspec)
                             cmd += libspec
                         else:
-                            cmd = "g++ {} -I %Z3DIR%/include -L %Z3DIR%/lib -L %Z3DIR%/bin -g -o {} {}.cpp -lws2_32".format(gpp11_spec,basename,basename)
+                            cmd = "g++ {} -I %Z3DIR%/include -L %Z3DIR%/lib -L %Z3DIR%/bin {} -o {} {}.cpp -lws2_32".format(gpp11_spec,gpp_profile_flags[opt_build_profile.get()],basename,basename)
                             if target.get() in ['gen','test']:
                                 cmd = cmd + ' -lz3'
                         if opt_outdir.get():
@@ -5966,19 +6425,33 @@ def main_int(is_ivyc):
                             _libdir = lib[2] if len(lib) >= 3 else (_dir  + '/lib')
                             paths += ' -I {}/include -L {} -Xlinker -rpath -Xlinker {}'.format(_dir,_libdir,_libdir)
                         if emit_main:
-                            cmd = "g++ -Wno-parentheses-equality {} {} -g -o {} {}.cpp".format(gpp11_spec,paths,basename,basename)
+                            cmd = "g++ -Wno-parentheses-equality {} {} {} -o {} {}.cpp".format(gpp11_spec,paths,gpp_profile_flags[opt_build_profile.get()],basename,basename)
                         else:
-                            cmd = "g++ -Wno-parentheses-equality {} {} -g -c {}.cpp".format(gpp11_spec,paths,basename)
+                            cmd = "g++ -Wno-parentheses-equality {} {} {} -c {}.cpp".format(gpp11_spec,paths,gpp_profile_flags[opt_build_profile.get()],basename)
                         if target.get() in ['gen','test']:
                             cmd = cmd + ' -lz3'
                         cmd += libspec
                         cmd += ' -pthread'
-                    print(cmd)
-                    sys.stdout.flush()
+                    if platform.system() == 'Windows':
+                        binary = basename + ('.exe' if emit_main else '.obj')
+                        if opt_outdir.get():
+                            binary = os.path.join(opt_outdir.get(),binary)
+                    else:
+                        binary = basename if emit_main else basename + '.o'
+                    stamp = outfile(builddir+'/'+basename+'.buildhash')
+                    key = build_hash(cmd,outfile(builddir+'/'+basename))
+                    with iu.WorkingDir(builddir):
+                        if opt_build_cache.get() and os.path.exists(binary) and read_build_hash(stamp) == key:
+                            print('{} is up to date'.format(binary))
+                        else:
+                            print(cmd)
+                            sys.stdout.flush()
+                            status = os.system(cmd)
+                            if status:
+                                exit(1)
+                    with open(stamp,'w') as f:
+                        f.write(key)
                     with iu.WorkingDir(builddir):
-                        status = os.system(cmd)
-                        if status:
-                            exit(1)
                         if target.get() in ['repl','test'] and not iu.version_le(iu.get_string_version(),"1.6"):
                             def describe_params(params,defaults):
                                 res = []
@@ -6021,7 +6494,7 @@ def main_int(is_ivyc):
             try:
                 descriptor = {'processes' : processes}
                 if target.get() == 'test':
-                    descriptor['test_params'] = ['iters','runs','seed','delay','wait','modelfile']
+                    descriptor['test_params'] = ['iters','runs','seed','delay','wait','modelfile','gen_stats','workers']
                 with open(mod_name + '.dsc','w') as dscf:
                     json.dump(descriptor,dscf)
             except:
@@ -6030,6 +6503,24 @@ def main_int(is_ivyc):
 
 def outfile(name):
     return (opt_outdir.get() + '/' + name) if opt_outdir.get() else name
+
+# With build_cache, the hash of the compile command and the generated
+# files is recorded in basename.buildhash after a successful build.
+# If it is unchanged and the binary exists, the compiler is not run.
+
+def build_hash(cmd,path):
+    h = hashlib.sha256(cmd.encode())
+    for ext in ['.h','.cpp']:
+        with open(path+ext,'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+def read_build_hash(stamp):
+    try:
+        with open(stamp) as f:
+            return f.read()
+    except IOError:
+        return None
         
 def find_vs():
     try:
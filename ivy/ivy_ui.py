@@ -68,7 +68,7 @@ class AnalysisGraphUI(object):
         if 'mode' in self.radios:
             return (None if (self.mode.get() == "concrete" or self.mode.get() == "abstract")
                     else ivy_alpha.alpha if self.mode.get() == "induction"
-                    else ivy_alpha.predicate_alpha if self.mode.get() == "pdr"
+                    else self.predicate_alpha if self.mode.get() == "pdr"
                     else top_alpha)
         return top_alpha
         
@@ -214,9 +214,16 @@ class AnalysisGraphUI(object):
     def get_alpha(self):
         return (None if self.mode.get() == "concrete"
                 else ivy_alpha.alpha if (self.mode.get() == "abstract" or self.mode.get() == "induction")
-                else ivy_alpha.predicate_alpha if self.mode.get() == "pdr"
+                else self.predicate_alpha if self.mode.get() == "pdr"
                 else top_alpha)
 
+    # Predicate abstraction, with the results memoized in the ARG
+
+    def predicate_alpha(self,state):
+        if not hasattr(self.g,'predicate_memo'): # ARG saved by an older version
+            self.g.predicate_memo = dict()
+        ivy_alpha.predicate_alpha(state,self.g.predicate_memo)
+
     # Get the node with given id
 
     def node(self,id):
@@ -5,6 +5,7 @@
 import string
 import operator
 import functools
+import importlib
 import collections
 import re
 import os
@@ -403,9 +404,20 @@ class EnumeratedParameter(Parameter):
     
 
 
+# Parameters of modules that are imported only when needed. This maps
+# the name of the parameter to the module (in this package) that
+# defines it, which is imported when the parameter is set.
+
+lazy_parameters = dict()
+
+def import_parameter(key):
+    if key not in registry and key in lazy_parameters:
+        importlib.import_module('.' + lazy_parameters[key],__package__)
+
 def set_parameters(values):
     global registry
     for key in values:
+        import_parameter(key)
         if key not in registry:
             raise IvyError(None,"parameter {} undefined".format(key))
         param = registry[key]
@@ -423,6 +435,7 @@ class parameterize(object):
         global registry
         self.old_values = dict()
         for key in self.new_values:
+            import_parameter(key)
             assert key in registry
             param = registry[key]
             self.old_values[key] = param.get()
@@ -201,8 +201,8 @@ class Eq(recstruct('Eq', [], ['t1', 't2'])):
 
 class Ite(recstruct('Ite', ['sort'], ['cond', 't_then', 't_else'])):
     __slots__ = ()
-    def __init__(self, cond, t_then, t_else):
-        super(Ite, self).__init__(t_then.sort,cond,t_then,t_else)
+    def __new__(cls, cond, t_then, t_else):
+        return super(Ite, cls).__new__(cls,t_then.sort,cond,t_then,t_else)
     @classmethod
     def _preprocess_(cls, sort, cond, t_then, t_else):
         if cond.sort not in (Boolean, TopS):
@@ -263,8 +263,8 @@ class Eventually(recstruct('Eventually', ['environ'], ['body'])):
 
 class WhenOperator(recstruct('WhenOperator', ['sort','name'], ['t1','t2'])):
     __slots__ = ()
-    def __init__(self, name, t1, t2):
-        super(WhenOperator, self).__init__(t1.sort,name,t1,t2)
+    def __new__(cls, name, t1, t2):
+        return super(WhenOperator, cls).__new__(cls,t1.sort,name,t1,t2)
     @classmethod
     def _preprocess_(cls, sort, name, t1, t2):
         assert isinstance(name,str)
@@ -276,8 +276,8 @@ class WhenOperator(recstruct('WhenOperator', ['sort','name'], ['t1','t2'])):
 
 class Cond(recstruct('Cond', ['sort'], ['t1', 't2'])):
     __slots__ = ()
-    def __init__(self, t1, t2):
-        super(Cond, self).__init__(t2.sort,t1,t2)
+    def __new__(cls, t1, t2):
+        return super(Cond, cls).__new__(cls,t2.sort,t1,t2)
     @classmethod
     def _preprocess_(cls, sort, t1, t2):
         bad_sorts = [i for i, t in enumerate([t1])
@@ -15,11 +15,17 @@ Iterating over a recstruct iterates only over its sub-structures.
 
 Subclasses of recstruct's can set __slots__ = () to save memory.
 
-Hash-consing can be added later as an option.
+Hash-consing is available as an option (see set_hash_consing). When
+it is enabled, structurally equal recstructs created by the
+constructor are the same object, and their hashes are cached. This
+applies only to classes whose instances have no __dict__ (i.e., all
+subclasses set __slots__), since otherwise instances could carry
+distinct mutable attributes.
 
 """
 
 import sys as _sys
+import weakref as _weakref
 from keyword import iskeyword as _iskeyword
 
 
@@ -27,6 +33,62 @@ def _init(self, *args):
     self._tup = args
 
 
+class _Interner(object):
+    """
+    The unique table for hash-consing. There is one table per class,
+    mapping the tuple of an instance to the instance. The tables hold
+    weak references, so an interned object is never replaced while it
+    is alive. This means two distinct interned objects are never equal.
+
+    The flag "active" stays on once hash-consing has been enabled,
+    since interned objects created earlier may still be alive.
+    """
+    enabled = False
+    active = False
+    tables = {}
+
+_interner = _Interner()
+
+
+def set_hash_consing(enabled):
+    """
+    Turn hash-consing of recstruct's on or off. Objects created while
+    it is off are not interned, but still compare equal to interned
+    objects with the same structure.
+    """
+    _interner.enabled = enabled
+    if enabled:
+        _interner.active = True
+
+
+def hash_consing_stats():
+    """
+    Return the number of live interned objects per class name.
+    """
+    return dict((cls.__name__, len(table)) for cls, table in _interner.tables.items())
+
+
+def _make(cls, tup):
+    if _interner.enabled and not cls.__dictoffset__:
+        table = _interner.tables.get(cls)
+        if table is None:
+            table = _interner.tables[cls] = _weakref.WeakValueDictionary()
+        self = table.get(tup)
+        if self is None:
+            self = object.__new__(cls)
+            self._tup = tup
+            self._hash = tup.__hash__()
+            table[tup] = self
+        return self
+    self = object.__new__(cls)
+    self._tup = tup
+    return self
+
+
+def _is_interned(x):
+    return hasattr(x, '_hash')
+
+
 def _itemgetter(x):
     return lambda self: self._tup.__getitem__(x)
 
@@ -34,7 +96,7 @@ def _itemgetter(x):
 _class_template = '''\
 class {typename}(object):
 
-    __slots__ = ('_tup')
+    __slots__ = ('_tup', '_hash', '__weakref__')
 
     _meta_fields = {meta_field_names!r}
     _sub_fields = {sub_field_names!r}
@@ -52,15 +114,24 @@ class {typename}(object):
         """
         return args
 
-    def __init__(self, {meta_arg_list_with_defaults}{sub_arg_list}):
-        self._tup = tuple(type(self)._preprocess_({meta_arg_list}{sub_arg_list}))
+    def __new__(cls, {meta_arg_list_with_defaults}{sub_arg_list}):
+        return _make(cls, tuple(cls._preprocess_({meta_arg_list}{sub_arg_list})))
+
+    def __init__(self, *args, **kwargs):
+        pass
 
     def __repr__(self):
         """Return a nicely formatted representation string"""
         return type(self).__name__ + repr(self._tup)
 
     def __eq__(self, other):
-        return type(self) is type(other) and (self._tup) == (other._tup)
+        if self is other:
+            return True
+        if type(self) is not type(other):
+            return False
+        if _interner.active and _is_interned(self) and _is_interned(other):
+            return False
+        return (self._tup) == (other._tup)
 
     def __ne__(self, other):
         return not self.__eq__(other)
@@ -79,6 +150,11 @@ class {typename}(object):
 
     def __hash__(self):
         #return hash((type(self), ) + self._tup)
+        if _interner.active:
+            try:
+                return self._hash
+            except AttributeError:
+                pass
         return self._tup.__hash__()
 
     def _subs(self):
@@ -102,6 +178,9 @@ class {typename}(object):
     def __nonzero__(self):
         raise TypeError("recstruct should not be converted to bool")
 
+    def __reduce__(self):
+        return (_make, (type(self), self._tup))
+
     def __getstate__(self):
         return {{'_tup': self._tup}}
 
@@ -203,6 +282,9 @@ def recstruct(typename, meta_field_names, sub_field_names, verbose=False):
         _itemgetter=_itemgetter,
         _property=property,
         _init=_init,
+        _make=_make,
+        _interner=_interner,
+        _is_interned=_is_interned,
     )
     try:
         exec(class_definition, namespace)
@@ -0,0 +1,145 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Benchmark for unsat core minimization (ivy_core).
+
+For each model, each conjecture is checked for relative inductiveness
+on its own, as in the CTI interface of `ivy`. For each
+counterexample, a diagram of the pre-state is computed and weakened
+to a minimal core, which is the core problem measured. Each core
+problem is solved with linear deletion (the previous algorithm) and
+with QuickXplain, and the number of solver checks, the time and the
+size of the core are reported.
+
+usage: python core.py [core_timeout=ms] [file.ivy ...]
+
+With no files, a default set of models in examples/ is used. Paths
+are relative to the root of the repository. If core_timeout is given,
+QuickXplain is also run with this time budget.
+"""
+
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(os.path.dirname(here))
+sys.path.insert(0,root)
+
+from ivy import ivy_init
+from ivy import ivy_module as im
+from ivy import ivy_isolate
+from ivy import ivy_trace
+from ivy import ivy_transrel
+from ivy import ivy_logic_utils as ilu
+from ivy import ivy_solver as slv
+from ivy import ivy_core
+from ivy.z3 import unsat
+
+default_models = [
+    'examples/ivy/learning.ivy',
+    'examples/pldi16/learning_switch.ivy',
+    'examples/pldi16/leader_election_ring.ivy',
+    'examples/pldi16/leader_election_ring_btw.ivy',
+]
+
+class CountingSolver(object):
+    """ Wraps a solver, counting the calls to check """
+    def __init__(self,s):
+        self.s = s
+        self.checks = 0
+    def check(self,*args):
+        self.checks += 1
+        return self.s.check(*args)
+    def unsat_core(self):
+        return self.s.unsat_core()
+
+def linear_core(s,alits,unlikely,timeout):
+    """ The previous algorithm: drop the unlikely literals one at a
+    time, then minimize by linear deletion """
+    core = alits
+    for lit in unlikely:
+        test = [c for c in core if ivy_core.get_id(c) != ivy_core.get_id(lit)]
+        if s.check(test) == unsat:
+            core = test
+    s.check(core)
+    return ivy_core.minimize_core_aux2(s,list(s.unsat_core()))
+
+def qx_core(s,alits,unlikely,timeout):
+    return ivy_core.biased_core(s,alits,unlikely,timeout)
+
+class Stats(object):
+    def __init__(self):
+        self.checks = 0
+        self.time = 0.0
+        self.size = 0
+
+def core_problems(fname):
+    """ Generate the core problems of a model, calling the core
+    minimization of ivy_solver with the conjectures of the model. """
+    with im.Module(), im.module.copy():
+        ivy_init.source_file(fname,ivy_init.open_read(fname),create_isolate=False)
+        ivy_isolate.create_isolate('this' if 'this' in im.module.isolates else None)
+        with im.module.theory_context():
+            axioms = im.module.background_theory()
+            for lf in im.module.labeled_conjs:
+                conj = ilu.Clauses([lf.formula])
+                ag,post,fail = ivy_trace.make_check_art(precond=[conj])
+                rev = ivy_transrel.reverse_image(ilu.dual_clauses(conj),axioms,post.update)
+                mod = slv.get_model_clauses(ilu.and_clauses(conj,rev,axioms))
+                if mod is not None:
+                    slv.clauses_model_to_diagram(rev,ivy_transrel.is_skolem,model=mod,axioms=axioms)
+
+def main():
+    timeout = None
+    models = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('core_timeout='):
+            timeout = int(arg[len('core_timeout='):])
+        else:
+            models.append(arg)
+    models = models or default_models
+    configs = [('linear',linear_core,0),('qx',qx_core,0)]
+    if timeout:
+        configs.append(('qx budget',qx_core,timeout))
+    ivy_init.read_params()
+    print('{:46} {:10} {:>5} {:>6} {:>7} {:>9} {:>6}'.format(
+        'model','algorithm','cores','lits','checks','time(s)','size'))
+    for fname in models:
+        stats = dict((name,Stats()) for name,_,_ in configs)
+        counts = {'cores' : 0, 'lits' : 0}
+        def bench_core(s,alits,unlikely):
+            counts['cores'] += 1
+            counts['lits'] += len(alits)
+            for name,alg,budget in configs:
+                # each algorithm uses a fresh copy of the solver
+                cs = CountingSolver(s.translate(s.ctx))
+                cs.s.check(alits)
+                start = time.time()
+                core = alg(cs,alits,unlikely,budget)
+                st = stats[name]
+                st.time += time.time() - start
+                st.checks += cs.checks
+                st.size += len(core)
+                assert s.check(core) == unsat
+            return core
+        def bench_minimize_core(s):
+            return bench_core(s,list(s.unsat_core()),[])
+        old_cores = slv.biased_core,slv.minimize_core
+        slv.biased_core,slv.minimize_core = bench_core,bench_minimize_core
+        cwd = os.getcwd()
+        dir,base = os.path.split(os.path.join(root,fname))
+        os.chdir(dir)
+        try:
+            core_problems(base)
+        finally:
+            os.chdir(cwd)
+            slv.biased_core,slv.minimize_core = old_cores
+        for name,_,_ in configs:
+            st = stats[name]
+            print('{:46} {:10} {:5} {:6} {:7} {:9.2f} {:6}'.format(
+                fname,name,counts['cores'],counts['lits'],st.checks,st.time,st.size))
+
+if __name__ == '__main__':
+    main()
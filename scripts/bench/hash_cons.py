@@ -0,0 +1,79 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Benchmark for hash-consing of logic terms (option hash_cons).
+
+Runs ivy_check on each model with and without hash_cons=true and
+reports wall-clock time and peak resident memory of the checker
+process. Each configuration is run several times and the best time
+and memory are reported.
+
+usage: python hash_cons.py [runs=N] [ivy_check=command] [file.ivy ...]
+
+With no files, a default set of the larger models in examples/ is
+used. Paths are relative to the root of the repository.
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(os.path.dirname(here))
+
+default_models = [
+    'examples/ivy/learning.ivy',
+    'examples/ivy/toy_consensus2.ivy',
+    'examples/ivy/indexset.ivy',
+    'examples/pldi16/learning_switch.ivy',
+    'examples/tilelink/tilelink_concrete_spec.ivy',
+]
+
+configs = [
+    ('plain', []),
+    ('hash_cons', ['hash_cons=true']),
+]
+
+def run_once(cmd,fname,opts):
+    """ Run the checker on fname, returning (seconds, max RSS in MB, result line) """
+    dir,base = os.path.split(os.path.join(root,fname))
+    start = time.time()
+    p = subprocess.Popen(cmd + opts + [base],cwd=dir,stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT,universal_newlines=True)
+    out = p.stdout.read()
+    _,status,usage = os.wait4(p.pid,0)
+    elapsed = time.time() - start
+    lines = out.strip().split('\n')
+    return elapsed, usage.ru_maxrss / 1024.0, lines[-1] if lines else ''
+
+def main():
+    runs = 3
+    cmd = ['ivy_check']
+    models = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('runs='):
+            runs = int(arg[5:])
+        elif arg.startswith('ivy_check='):
+            cmd = arg[10:].split()
+        else:
+            models.append(arg)
+    models = models or default_models
+    print('{:50} {:10} {:>9} {:>9}  {}'.format('model','config','time(s)','rss(MB)','result'))
+    totals = dict((name,[0.0,0.0]) for name,_ in configs)
+    for fname in models:
+        for name,opts in configs:
+            results = [run_once(cmd,fname,opts) for i in range(runs)]
+            t = min(r[0] for r in results)
+            m = min(r[1] for r in results)
+            totals[name][0] += t
+            totals[name][1] += m
+            print('{:50} {:10} {:9.2f} {:9.1f}  {}'.format(fname,name,t,m,results[-1][2]))
+    print('')
+    for name,_ in configs:
+        t,m = totals[name]
+        print('{:50} {:10} {:9.2f} {:9.1f}'.format('total',name,t,m))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#
+# Copyright (c) Microsoft Corporation. All Rights Reserved.
+#
+"""
+Benchmark for the start-up time of ivy_check.
+
+Measures the time to import the ivy_check module, and the wall-clock
+time of ivy_check on small models, for which most of the time is
+start-up. The models are run in the given order, so that a model in
+one language version follows a model in another, as in a test suite.
+Each measurement is repeated several times and the median is reported.
+
+usage: python startup.py [runs=N] [python=command] [file.ivy ...]
+
+With no files, a default set of small tests is used. Paths are
+relative to the root of the repository.
+"""
+
+import os
+import sys
+import time
+import subprocess
+
+here = os.path.dirname(os.path.abspath(__file__))
+root = os.path.dirname(os.path.dirname(here))
+
+default_models = [
+    'test/array.ivy',      # ivy1.6
+    'test/fba.ivy',        # ivy1.7
+    'test/map1.ivy',       # ivy1.8
+]
+
+def run_once(cmd,dir='.'):
+    """ Run cmd, returning (seconds, last line of output) """
+    start = time.time()
+    p = subprocess.Popen(cmd,cwd=dir,stdout=subprocess.PIPE,
+                         stderr=subprocess.STDOUT,universal_newlines=True)
+    out = p.communicate()[0]
+    elapsed = time.time() - start
+    lines = out.strip().split('\n')
+    return elapsed, lines[-1] if lines else ''
+
+def median(xs):
+    return sorted(xs)[len(xs)//2]
+
+def main():
+    runs = 5
+    python = [sys.executable]
+    models = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('runs='):
+            runs = int(arg[5:])
+        elif arg.startswith('python='):
+            python = arg[7:].split()
+        else:
+            models.append(arg)
+    models = models or default_models
+    times = dict()
+    results = dict()
+    imports = []
+    for i in range(runs):
+        imports.append(run_once(python + ['-c','import ivy.ivy_check'],root)[0])
+        for fname in models:
+            dir,base = os.path.split(os.path.join(root,fname))
+            t,res = run_once(python + ['-m','ivy.ivy_check',base],dir)
+            times.setdefault(fname,[]).append(t)
+            results[fname] = res
+    print('{:50} {:>9}  {}'.format('model','time(s)','result'))
+    print('{:50} {:9.2f}'.format('import ivy.ivy_check',median(imports)))
+    for fname in models:
+        print('{:50} {:9.2f}  {}'.format(fname,median(times[fname]),results[fname]))
+
+if __name__ == '__main__':
+    main()
@@ -50,6 +50,26 @@ checks = [
           ['oddeven4','OK'],
           ['learning_switch1','trace=true','learning_switch1.ivy: line 37:'],
           ['ded1','OK'],
+          ['fba','vc_cache=.ivy_cache','OK'],
+          ['fba','vc_cache=.ivy_cache','OK'],
+          ['skolem1','vc_cache=.ivy_cache','error: failed checks: 1'],
+          ['skolem1','vc_cache=.ivy_cache','error: failed checks: 1'],
+          ['fba','parse_cache=.ivy_parse_cache','OK'],
+          ['fba','parse_cache=.ivy_parse_cache','OK'],
+          ['bmcincr1','BMC with bound 3 found a counter-example'],
+          ['bmcincr1','bmc_incremental=true','BMC with bound 3 found a counter-example'],
+          ['kind1','OK'],
+          ['kind2','k-induction found a counter-example of length 2'],
+          ['kind3','error: k-induction inconclusive up to depth 2'],
+          ['kind4','jobs=2','OK'],
+          ['vcsession1','error: failed checks: 2'],
+          ['vcsession1','vc_cache=.ivy_cache','error: failed checks: 2'],
+          ['vcsession1','vc_cache=.ivy_cache','error: failed checks: 2'],
+          ['mcsim1','mc_sim=10','mcsim1.ivy: line 15'],
+          ['client_server_mc_finite1','mc_engine=pdr,bmc3','OK'],
+          ['vclimit1','error: inconclusive checks: 1'],
+          ['vcsession1','profile=vcsession1_profile.csv','error: failed checks: 2'],
+          ['vcsession1','update_cache=false','error: failed checks: 2'],
       ]
     ],
     ['../doc/examples/testing',
@@ -67,9 +87,11 @@ checks = [
       ['array1','error: Some assertions are not checked'],
       ['arrayset2','OK'],
       ['arrayset3','OK'],
+      ['arrayset3','z3_cache_size=10','OK'],
       ['arrayset','OK'],
       ['client_server_example','OK'],
       ['counter_example','counter_example.ivy: line 54: guarantee ... FAIL'],
+      ['counter_example','trace=true shrink=binary','assert \\[cp\\] cp.was_up'],
       ['coveragefail','error: Some assertions are not checked'],
       ['helloworld','OK'],
       ['interference2','OK'],
@@ -79,6 +101,7 @@ checks = [
       ['leader_election_ring2','error: Some assertions are not checked'],
       ['leader_election_ring_btw','leader_election_ring_btw.ivy: line 118: guarantee ... FAIL'],
       ['leader_election_ring','leader_election_ring.ivy: line 114: guarantee ... FAIL'],
+      ['leader_election_ring','jobs=2','leader_election_ring.ivy: line 114: guarantee ... FAIL'],
       ['leader_election_ring_repl','OK'],
       ['leader_election_ring_udp2','OK'],
       ['leader_election_ring_udp','OK'],
@@ -97,6 +120,7 @@ checks = [
       ['udp_test','OK'],
       ['list_reverse','OK'],
       ['indexset','OK'],
+      ['indexset','hash_cons=true','OK'],
       ['number_theory','OK'],
       ]
      ],
@@ -123,6 +147,15 @@ tests = [
          ['token_ring','isolate=iso_n','test_completed'],
          ['token_ring','isolate=iso_pt','test_completed'],
       ]
+     ],
+    ['.',
+      [
+         ['fastgen1','isolate=iso','test_completed'],
+         ['fastgen1','isolate=iso fast_gen=false','test_completed'],
+         ['fastgen1','isolate=iso test_workers=3','test_completed'],
+         ['fastgen1','isolate=iso build_profile=release','test_completed'],
+         ['workers1','isolate=iso test_workers=4','reproduce with seed='],
+      ]
      ]
 ]
 
@@ -142,6 +175,9 @@ repls = [
          ['leader_election_ring_udp2','isolate=iso_impl',None],
          ['paraminit','isolate=iso_foo',None],
          ['paraminit3','isolate=iso_foo',None],
+         ['timeout_test','event_loop=true','timeout_test_expect'],
+         ['udp_test','isolate=iso_impl event_loop=true','udp_test_expect'],
+         ['leader_election_ring_udp2','isolate=iso_impl event_loop=true','leader_election_ring_udp2_expect'],
       ]
      ]
 ]